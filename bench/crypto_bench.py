@@ -0,0 +1,63 @@
+"""Messages per second of the per-message ECIES work in websock.process.
+
+before: base64-decode the user's keys and let ecies parse them on every message
+after:  coincurve key objects from server.crypto.KeyCache
+
+Usage: python bench/crypto_bench.py [messages] [response_bytes]
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import ecies  # noqa: E402
+from server.crypto import (  # noqa: E402
+    KeyCache, decrypt_data, decrypt_with_key, encrypt_data, encrypt_with_key, generate_key_pair
+)
+
+
+def make_user():
+    server_secret, server_public = generate_key_pair()
+    client_secret, client_public = generate_key_pair()
+    user = {"secret": server_secret, "public_key": client_public}
+    request = ecies.encrypt(base64.b64decode(server_public), b"|".join(
+        base64.b64encode(name) for name in (b"python", b"nginx", b"openssl")
+    ))
+    return user, request
+
+
+def before(user, request, response):
+    decrypt_data(base64.b64decode(user["secret"]), request)
+    encrypt_data(base64.b64decode(user["public_key"]), response)
+
+
+def after(cache, user, request, response):
+    keys = cache.get("bench", user)
+    decrypt_with_key(keys.secret, request)
+    encrypt_with_key(keys.public, response)
+
+
+def rate(func, messages):
+    started = time.perf_counter()
+    for _ in range(messages):
+        func()
+    return messages / (time.perf_counter() - started)
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    response = os.urandom(int(sys.argv[2]) if len(sys.argv) > 2 else 2048)
+    user, request = make_user()
+    cache = KeyCache()
+
+    old = rate(lambda: before(user, request, response), messages)
+    new = rate(lambda: after(cache, user, request, response), messages)
+    print(f"messages: {messages}, response bytes: {len(response)}")
+    print(f"before: {old:10.1f} msg/s")
+    print(f"after:  {new:10.1f} msg/s ({new / old:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
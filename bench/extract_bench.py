@@ -0,0 +1,147 @@
+"""Candidate extraction speed of ContentAnalyzer._extract_possible.
+
+Runs the previous implementation (patterns rebuilt per page, pairwise
+dedup) and the current one over the same corpus, checks that both return
+exactly the same candidates and prints the timings. Then times the scan
+limited to windows around each software name's mentions.
+
+Usage: python bench/extract_bench.py [pages_dir]
+
+Without pages_dir a deterministic synthetic corpus of release-page text is
+used; pages_dir may hold cleaned page texts (*.txt) recorded from real runs.
+"""
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from services.content_analyzer import ContentAnalyzer  # noqa: E402
+
+
+def legacy_extract_possible(version_patterns, data):
+    software_pattern = r'[A-Za-z][\w\.\+\-\#]+ [A-Za-z][\w\.\+\-\#]+'
+
+    version_keywords = [
+        r'latest', r'version', r'release', r'stable', r'updated', r'current',
+        r'lts', r'beta', r'alpha', r'rc\d*', r'build', r'update'
+    ]
+
+    version_pattern = '|'.join(version_patterns)
+    keyword_pattern = '|'.join(version_keywords)
+
+    context_words = r'(?:версии|version|ver\.|v\.|release|rel\.|for|of|на|with)'
+
+    patterns = [
+        rf'(?<!\w)({software_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({version_pattern})(?!\w)',
+        rf'(?<!\w)({version_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({software_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+{context_words}\s+({version_pattern})(?!\w)',
+        rf'(?<!\w)({version_pattern})\s+{context_words}\s+({software_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+({keyword_pattern})\s+({version_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+({keyword_pattern})\s+({version_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+({version_pattern})(?!\w)',
+    ]
+
+    all_matches = []
+    for pattern in patterns:
+        for match in re.finditer(pattern, data, re.IGNORECASE):
+            full_match = match.group(0).strip()
+            has_version = any(re.search(vp, full_match, re.IGNORECASE) for vp in version_patterns)
+            potential_software = re.search(r'\b[A-Za-z]\w+\b', full_match, re.IGNORECASE)
+            if has_version and potential_software:
+                all_matches.append(re.sub(r'\s+', ' ', full_match))
+
+    unique_matches = []
+    for match in all_matches:
+        is_substring = False
+        for other in all_matches:
+            if match != other and match in other:
+                match_words = set(re.findall(r'\b\w+\b', match))
+                other_words = set(re.findall(r'\b\w+\b', other))
+                if match_words.issubset(other_words) and len(match) < len(other):
+                    is_substring = True
+                    break
+        if not is_substring and match not in unique_matches:
+            unique_matches.append(match)
+    return unique_matches
+
+
+SOFTWARE = ["Python", "nginx", "OpenSSL", "Node.js", "PostgreSQL", "Visual Studio Code",
+            "Mozilla Firefox", "Google Chrome", "Apache httpd", "Docker Desktop", "7-Zip", "C++ Builder"]
+FILLER = ["Download", "the", "installer", "for", "Windows", "and", "macOS", "is", "available",
+          "changelog", "security", "fixes", "see", "notes", "mirror", "release", "page", "new",
+          "features", "and", "bug", "fixes", "на", "сайте", "версии", "with", "support", "of"]
+TEMPLATES = [
+    "{sw} {v} released", "{sw} latest version {v}", "{v} release of {sw}", "{sw} version {v}",
+    "{sw} stable {v}", "Download {sw} {v} for Windows", "{sw} {v}-rc1", "{sw} ver. {v}",
+    "{v} for {sw}", "{sw} LTS {v}", "{sw} build {v}", "{sw} v{v}",
+]
+
+
+def synthetic_corpus(pages=5, chars=5000, seed=1):
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(pages):
+        parts = []
+        size = 0
+        while size < chars:
+            if rnd.random() < 0.35:
+                version = ".".join(str(rnd.randint(0, 30)) for _ in range(rnd.randint(1, 3)))
+                text = rnd.choice(TEMPLATES).format(sw=rnd.choice(SOFTWARE), v=version)
+            else:
+                text = " ".join(rnd.choice(FILLER) for _ in range(rnd.randint(3, 12)))
+            parts.append(text + rnd.choice([". ", " ", ", "]))
+            size += len(parts[-1])
+        corpus.append("".join(parts)[:chars])
+    return corpus
+
+
+def load_corpus(path):
+    corpus = []
+    for name in sorted(glob.glob(os.path.join(path, "*.txt"))):
+        with open(name, encoding="utf-8") as page:
+            corpus.append(page.read())
+    return corpus
+
+
+def timed(func, corpus, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        results = [func(page) for page in corpus]
+    return (time.perf_counter() - started) / rounds, results
+
+
+def main():
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus()
+    analyzer = ContentAnalyzer("", "")
+    patterns = analyzer.version_patterns
+    rounds = 3
+
+    old_time, old = timed(lambda page: legacy_extract_possible(patterns, page), corpus, rounds)
+    new_time, new = timed(analyzer._extract_possible, corpus, rounds)
+
+    if old != new:
+        for index, (a, b) in enumerate(zip(old, new)):
+            if a != b:
+                print(f"page {index} differs:\n  before: {a}\n  after:  {b}")
+        sys.exit(1)
+
+    print(f"pages: {len(corpus)}, candidates: {sum(len(r) for r in new)}, identical output")
+    print(f"before: {old_time * 1000:8.1f} ms per corpus")
+    print(f"after:  {new_time * 1000:8.1f} ms per corpus ({old_time / new_time:.2f}x)")
+
+    # Only the text around mentions of the software looked up, see SWUC_SCAN_WINDOW
+    windowed_time = candidates = 0
+    for name in SOFTWARE:
+        elapsed, results = timed(lambda page: analyzer._extract_possible(page, name), corpus, rounds)
+        windowed_time += elapsed / len(SOFTWARE)
+        candidates += sum(len(r) for r in results) / len(SOFTWARE)
+    print(f"windowed around the name ({analyzer.window} chars): {windowed_time * 1000:8.1f} ms per corpus "
+          f"({old_time / windowed_time:.2f}x), {candidates:.0f} candidates per name")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Local stand-ins for the upstream services, used by load_bench.py.
+
+FakeSearch      Yandex XML search, links every query to pages on the page hosts
+FakePages       page hosts, recorded HTML from a directory or generated pages
+FakeSafety      Safe Browsing threatMatches:find
+FakeGpt         YandexGPT completion, single and batched prompts
+FakeRegistry    PyPI, npm, GitHub releases and crates.io for structured sources
+
+Every fake answers after `latency` seconds (plus up to `jitter`) and fails a
+share `error_rate` of requests with `error_status`. A 429 carries Retry-After.
+The version a fake reports for a name is derived from the name, so every
+fake agrees on it and a response can be checked.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+Reply = Tuple[int, Dict[str, str], bytes]
+
+QUERY_SUFFIX = " latest version"
+
+# Other software a download page links to, with versions that must not be picked
+UNRELATED = ["Mozilla Firefox", "Google Chrome", "Notepad Plus", "Adobe Reader", "VLC Player", "WinRAR Archiver"]
+
+
+def _fraction(name: str, salt: str = "") -> float:
+    """Stable number in [0, 1) for a name"""
+    digest = hashlib.sha256((salt + name.lower()).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def version_of(name: str) -> str:
+    """The latest version of name as far as the fakes are concerned"""
+    digest = hashlib.sha256(name.lower().encode("utf-8")).digest()
+    return f"{digest[0] % 20 + 1}.{digest[1] % 30}.{digest[2] % 10}"
+
+
+def slug_of(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "software"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, headers, payload = self.server.fake.reply(self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _serve
+    do_POST = _serve
+
+    def do_HEAD(self) -> None:
+        # The server opens its connections at startup with a HEAD
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        pass  # The request log would cost more than the fake itself
+
+
+class FakeUpstream:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeUpstream":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+    def reply(self, method: str, path: str, headers, body: bytes) -> Reply:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+        if failed:
+            extra = {"Retry-After": "1"} if self.error_status == 429 else {}
+            return self.error_status, extra, b"fake upstream error"
+        return self.handle(method, urlparse(path), headers, body)
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        raise NotImplementedError
+
+
+class FakePages(FakeUpstream):
+    """Pages at /<slug>/<n>. A recorded page is <slug>.html in pages_dir,
+    other names get a generated page mentioning their version. A share
+    `ambiguous` of names gets pages that disagree, so the server has to ask
+    the GPT fake. Pages carry an ETag and answer If-None-Match with 304."""
+
+    def __init__(self, pages_dir: Optional[str] = None, ambiguous: float = 0.2, **options):
+        super().__init__(**options)
+        self.pages_dir = pages_dir
+        self.ambiguous = ambiguous
+        self.not_modified = 0
+
+    def page_url(self, name: str, index: int) -> str:
+        return f"{self.url}/{quote(slug_of(name))}/{index}?name={quote(name)}"
+
+    def _recorded(self, slug: str) -> Optional[bytes]:
+        if not self.pages_dir:
+            return None
+        path = os.path.join(self.pages_dir, f"{slug}.html")
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as page:
+            return page.read()
+
+    def _generate(self, name: str, index: int) -> bytes:
+        latest = version_of(name)
+        major, minor, patch = (int(part) for part in latest.split("."))
+        older = f"{major}.{max(0, minor - 1)}.{patch}"
+        if _fraction(name, "ambiguous") < self.ambiguous:
+            latest = f"{major}.{minor}.{patch + index}"
+        return (
+            f"<html><head><title>{escape(name)} downloads</title>"
+            "<script>var tracking = {id: 12345};</script></head><body>"
+            f"<nav>Home | Products | Support | Blog</nav>"
+            f"<h1>Download {escape(name)}</h1>"
+            f"<p>{escape(name)} {latest} is the latest stable release, published this month.</p>"
+            f"<p>Release notes for {escape(name)} {latest}: bug fixes and performance improvements.</p>"
+            f"<h2>Previous releases</h2><ul><li>{escape(name)} {older}</li>"
+            f"<li>{escape(name)} {major}.0.0</li></ul>"
+            + "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 20
+            + "<aside>Popular downloads: "
+            + ", ".join(f"{other} {version_of(other)} latest version" for other in UNRELATED)
+            + "</aside><footer>Copyright 2024</footer></body></html>"
+        ).encode("utf-8")
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if len(parts) != 2:
+            return 404, {}, b"not found"
+        slug, index = parts[0], int(parts[1]) if parts[1].isdigit() else 0
+        name = parse_qs(url.query).get("name", [slug])[0]
+        page = self._recorded(slug) or self._generate(name, index)
+
+        etag = f'"{hashlib.sha256(page).hexdigest()[:16]}"'
+        if headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified += 1
+            return 304, {"ETag": etag}, b""
+        return 200, {
+            "Content-Type": "text/html; charset=utf-8",
+            "ETag": etag,
+            "Last-Modified": formatdate(usegmt=True)
+        }, page
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats["not_modified"] = self.not_modified
+        return stats
+
+
+class FakeSearch(FakeUpstream):
+    """Yandex XML answer linking a query to `results` pages, spread over the page hosts"""
+
+    def __init__(self, hosts: List[FakePages], **options):
+        super().__init__(**options)
+        self.hosts = hosts
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        params = parse_qs(url.query)
+        query = params.get("query", [""])[0]
+        name = query[:-len(QUERY_SUFFIX)] if query.endswith(QUERY_SUFFIX) else query
+        groups = re.search(r"groups-on-page=(\d+)", params.get("groupby", [""])[0])
+        results = int(groups.group(1)) if groups else 5
+
+        docs = "".join(
+            f"<group><doc><url>{escape(self.hosts[index % len(self.hosts)].page_url(name, index))}</url>"
+            f"<domain>127.0.0.1</domain><title>{escape(name)}</title></doc></group>"
+            for index in range(results)
+        )
+        xml = (
+            '<?xml version="1.0" encoding="utf-8"?><yandexsearch version="1.0">'
+            f"<request><query>{escape(query)}</query></request><response><results>"
+            f"<grouping>{docs}</grouping></results></response></yandexsearch>"
+        )
+        return 200, {"Content-Type": "text/xml; charset=utf-8"}, xml.encode("utf-8")
+
+
+class FakeSafety(FakeUpstream):
+    """Reports a share `unsafe` of URLs as malware"""
+
+    def __init__(self, unsafe: float = 0.0, **options):
+        super().__init__(**options)
+        self.unsafe = unsafe
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        entries = json.loads(body or b"{}").get("threatInfo", {}).get("threatEntries", [])
+        matches = [
+            {"threatType": "MALWARE", "platformType": "ANY_PLATFORM", "threat": {"url": entry["url"]}}
+            for entry in entries
+            if _fraction(entry.get("url", ""), "unsafe") < self.unsafe
+        ]
+        reply = {"matches": matches} if matches else {}
+        return 200, {"Content-Type": "application/json"}, json.dumps(reply).encode("utf-8")
+
+
+class FakeGpt(FakeUpstream):
+    """Answers with version_of() for every program named in the prompt"""
+
+    _SINGLE = re.compile(r"Определи последнюю версию (.+?)\.\n")
+    _BATCH = re.compile(r"^### (\d+): (.+)$", re.MULTILINE)
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        messages = json.loads(body or b"{}").get("messages", [])
+        system = next((m["text"] for m in messages if m.get("role") == "system"), "")
+        user = next((m["text"] for m in messages if m.get("role") == "user"), "")
+
+        batch = self._BATCH.findall(user)
+        single = self._SINGLE.search(system)
+        if single:
+            text = version_of(single.group(1))
+        else:
+            text = json.dumps({index: version_of(name.strip()) for index, name in batch})
+
+        reply = {"result": {
+            "alternatives": [{"message": {"role": "assistant", "text": text}, "status": "ALTERNATIVE_STATUS_FINAL"}],
+            "usage": {"inputTextTokens": str(len(system + user) // 4), "completionTokens": "10"},
+            "modelVersion": "fake"
+        }}
+        return 200, {"Content-Type": "application/json"}, json.dumps(reply).encode("utf-8")
+
+
+class FakeRegistry(FakeUpstream):
+    """PyPI JSON, npm dist-tags, GitHub releases Atom and crates.io in one
+    server, every package at version_of(package). Packages whose name starts
+    with "missing" are unknown (404)"""
+
+    def handle(self, method: str, url, headers, body: bytes) -> Reply:
+        path = unquote(url.path)
+        pypi = re.fullmatch(r"/pypi/(.+)/json", path)
+        npm = re.fullmatch(r"/-/package/(.+)/dist-tags", path)
+        github = re.fullmatch(r"/([^/]+/[^/]+)/releases\.atom", path)
+        crates = re.fullmatch(r"/api/v1/crates/([^/]+)", path)
+        package = next((m.group(1) for m in (pypi, npm, github, crates) if m), None)
+        if package is None or package.split("/")[-1].startswith("missing"):
+            return 404, {}, b"not found"
+
+        version = version_of(package)
+        if pypi:
+            reply = {"info": {"name": package, "version": version}}
+        elif npm:
+            reply = {"latest": version, "next": f"{version}-rc.1"}
+        elif crates:
+            reply = {"crate": {"name": package, "max_stable_version": version, "newest_version": f"{version}-beta.1"}}
+        else:
+            # Newest first, a pre-release ahead of the stable release
+            entries = "".join(
+                f"<entry><id>tag:github.com,2008:Repository/1/{tag}</id><title>{tag}</title>"
+                f'<link rel="alternate" type="text/html" href="{self.url}/{package}/releases/tag/{tag}"/></entry>'
+                for tag in (f"v{version}-rc1", f"v{version}")
+            )
+            feed = f'<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>'
+            return 200, {"Content-Type": "application/atom+xml"}, feed.encode("utf-8")
+        return 200, {"Content-Type": "application/json"}, json.dumps(reply).encode("utf-8")
@@ -0,0 +1,383 @@
+"""Throughput and latency of the whole server against local upstream fakes.
+
+Starts the fakes from fakes.py and `python src/main.py` in a scratch
+directory, with the Yandex endpoints pointed at the fakes. It then
+provisions one user per client the way the `new` command does, and runs
+each scenario with real encrypted requests from concurrent WebSocket
+clients:
+
+cold     every name is new: search, safety check, page fetches, analysis
+warm     a small set of names already in the result cache
+mixed    names drawn from a popular-heavy (Zipf) distribution
+binary   the warm set over the binary protocol
+stream   new names with streamed per-name results
+registry new names with ecosystem hints ("pypi:name"), answered by structured sources
+
+Results go to a JSON file named after the current commit, so two commits
+can be compared with any JSON diff.
+
+Usage: python bench/load_bench.py [--scenarios cold,warm] [--clients 8] [--requests 200]
+       [--workers 1] [--page-latency 0.05] [--error-rate 0.01] [--out results.json] ...
+       python bench/load_bench.py --help
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC)
+
+import ecies  # noqa: E402
+from websockets.asyncio.client import connect  # noqa: E402
+from fakes import FakeGpt, FakePages, FakeRegistry, FakeSafety, FakeSearch, version_of  # noqa: E402
+
+SCENARIOS = ("cold", "warm", "mixed", "binary", "stream", "registry")
+WARM_NAMES = 20
+MIXED_NAMES = 500
+# The registry scenario spreads its names over the structured sources
+REGISTRY_HINTS = ("pypi:", "npm:", "crates:", "github:bench/")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Client:
+    """One user's connection, speaking the text or binary protocol"""
+
+    def __init__(self, conf: dict):
+        self.uuid = conf["uuid"]
+        self.server_public = base64.b64decode(conf["public"])
+        self.secret = base64.b64decode(conf["secret"])
+        self.websocket = None
+
+    async def open(self, url: str) -> None:
+        self.websocket = await connect(url, max_size=None)
+
+    async def close(self) -> None:
+        await self.websocket.close()
+
+    def _text_request(self, names, stream):
+        raw = "|".join(base64.b64encode(name.encode()).decode() for name in names).encode()
+        request = {"uuid": self.uuid, "raw": base64.b64encode(ecies.encrypt(self.server_public, raw)).decode()}
+        if stream:
+            request["stream"] = True
+        return base64.b64encode(json.dumps(request).encode()).decode()
+
+    def _binary_request(self, names, stream):
+        from server import wire
+        flags, payload = wire.compress(wire.encode_names(names))
+        if stream:
+            flags |= wire.FLAG_STREAM
+        return wire.pack_request(flags, self.uuid, ecies.encrypt(self.server_public, payload))
+
+    def _open_frame(self, frame):
+        """The decrypted response, None for the server's plain text errors"""
+        try:
+            if isinstance(frame, bytes):
+                from server import wire
+                flags, ciphertext = wire.parse_response(frame)
+                return json.loads(wire.decompress(flags, ecies.decrypt(self.secret, ciphertext)))
+            return json.loads(ecies.decrypt(self.secret, base64.b64decode(frame)))
+        except Exception:
+            return None
+
+    async def lookup(self, names, binary=False, stream=False):
+        """Send one request, returns the software results or None when it was refused"""
+        build = self._binary_request if binary else self._text_request
+        await self.websocket.send(build(names, stream))
+        results = []
+        while True:
+            response = self._open_frame(await self.websocket.recv())
+            if response is None:
+                return None
+            if response["status"] == "item":
+                results.append(response["software"])
+                continue
+            return results if response["status"] == "done" else response["software"]
+
+
+class Scenario:
+    def __init__(self, name: str, names, binary=False, stream=False, warmup=()):
+        self.name = name
+        self.names = names  # callable(request number) -> names of that request
+        self.binary = binary
+        self.stream = stream
+        self.warmup = list(warmup)
+
+
+def build_scenarios(args, run_id):
+    per_request = args.names_per_request
+    warm = [f"warm-app-{i}" for i in range(WARM_NAMES)]
+    popular = [f"mixed-app-{i}" for i in range(MIXED_NAMES)]
+    weights = [1 / (rank + 1) for rank in range(MIXED_NAMES)]
+    rng = random.Random(args.seed)
+
+    def cold(prefix):
+        return lambda n: [f"{prefix}-{run_id}-{n}-{i}" for i in range(per_request)]
+
+    return {
+        "cold": Scenario("cold", cold("cold-app")),
+        "warm": Scenario("warm", lambda n: rng.sample(warm, per_request), warmup=warm),
+        "mixed": Scenario("mixed", lambda n: rng.choices(popular, weights, k=per_request)),
+        "binary": Scenario("binary", lambda n: rng.sample(warm, per_request), binary=True, warmup=warm),
+        "stream": Scenario("stream", cold("stream-app"), stream=True),
+        "registry": Scenario("registry", lambda n: [
+            f"{REGISTRY_HINTS[i % len(REGISTRY_HINTS)]}{name}"
+            for i, name in enumerate(cold("registry-app")(n))
+        ]),
+    }
+
+
+def expected_version(name):
+    # Hinted names are looked up by their package, which the fakes version
+    return version_of(name.split(":", 1)[-1])
+
+
+async def warm_up(scenario, client, args):
+    """Get the scenario's names into the result cache before it is measured"""
+    for start in range(0, len(scenario.warmup), args.names_per_request):
+        await client.lookup(scenario.warmup[start:start + args.names_per_request])
+
+
+async def run_scenario(scenario, clients, args):
+    latencies = []
+    counts = {"requests": 0, "names": 0, "refused": 0, "failed_names": 0, "wrong_versions": 0}
+    counter = iter(range(args.requests))
+
+    async def client_loop(client):
+        for number in counter:
+            names = scenario.names(number)
+            started = time.perf_counter()
+            try:
+                results = await client.lookup(names, scenario.binary, scenario.stream)
+            except Exception:
+                results = None
+            latencies.append(time.perf_counter() - started)
+            counts["requests"] += 1
+            if results is None:
+                counts["refused"] += 1
+                continue
+            counts["names"] += len(results)
+            for item in results:
+                if item["error"]:
+                    counts["failed_names"] += 1
+                elif item["version"] != expected_version(item["name"]):
+                    counts["wrong_versions"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(client) for client in clients))
+    elapsed = time.perf_counter() - started
+
+    return {
+        **counts,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(counts["requests"] / elapsed, 2),
+        "names_per_second": round(counts["names"] / elapsed, 2),
+        "latency_ms": {
+            label: round(percentile(latencies, q) * 1000, 1)
+            for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        }
+    }
+
+
+def start_fakes(args):
+    def options(latency, error_status=500):
+        return {"latency": latency, "jitter": latency * args.jitter,
+                "error_rate": args.error_rate, "error_status": error_status}
+
+    pages = [FakePages(args.pages, args.ambiguous, **options(args.page_latency)).start()
+             for _ in range(args.page_hosts)]
+    return {
+        "search": FakeSearch(pages, **options(args.search_latency, 429)).start(),
+        "safety": FakeSafety(args.unsafe, **options(args.safety_latency)).start(),
+        "gpt": FakeGpt(**options(args.gpt_latency, 429)).start(),
+        "registry": FakeRegistry(**options(args.registry_latency)).start(),
+        "pages": pages,
+    }
+
+
+def fake_stats(fakes):
+    stats = {name: fake.stats() for name, fake in fakes.items() if name != "pages"}
+    pages = [host.stats() for host in fakes["pages"]]
+    stats["pages"] = {key: sum(host[key] for host in pages) for key in pages[0]}
+    return stats
+
+
+def stats_delta(after, before):
+    return {
+        api: {key: value - before[api][key] for key, value in counts.items()}
+        for api, counts in after.items()
+    }
+
+
+def server_env(args, fakes, workdir, port):
+    env = dict(os.environ)
+    env.update({
+        "SWUC_SERVER_ADDR": "127.0.0.1",
+        "SWUC_SERVER_PORT": str(port),
+        "SWUC_WORKERS": str(args.workers),
+        "SWUC_METRICS_PORT": "0",
+        "SWUC_USERS_PATH": os.path.join(workdir, "users.json"),
+        "SWUC_SEARCH_URL": fakes["search"].url,
+        "SWUC_SAFETY_URL": fakes["safety"].url + "/v4/threatMatches:find",
+        "SWUC_GPT_URL": fakes["gpt"].url + "/foundationModels/v1/completion",
+        "SWUC_SOURCES_MAP": os.path.join(workdir, "sources.json"),
+        **{f"SWUC_SOURCE_{source}_URL": fakes["registry"].url for source in ("PYPI", "NPM", "GITHUB", "CRATES")},
+        "YANDEX_FOLDER_ID": "bench",
+        "YANDEX_SEARCH_API_KEY": "bench",
+        "YANDEX_SAFE_BROWSING_API_KEY": "bench",
+        "YANDEX_GPT_API_KEY": "bench",
+        "SWUC_MAX_LOOKUPS_PER_USER": str(args.requests * args.names_per_request),
+        "SWUC_MAX_QUEUED_LOOKUPS": str(args.requests * args.names_per_request),
+    })
+    if not args.quotas:
+        # Measure the server, not the API rate limits
+        for api in ("SEARCH", "SAFETY", "GPT"):
+            env[f"SWUC_QUOTA_{api}_RATE"] = "0"
+    return env
+
+
+async def wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server did not listen on port {port} within {timeout}s")
+
+
+async def main_async(args):
+    run_id = f"{int(time.time())}"
+    workdir = tempfile.mkdtemp(prefix="swuc-bench-")
+    port = free_port()
+    fakes = start_fakes(args)
+
+    # Users go to the scratch registry the server will read
+    os.environ["SWUC_USERS_PATH"] = os.path.join(workdir, "users.json")
+    from server.commands import provision_user
+    url = f"ws://127.0.0.1:{port}"
+    users = [provision_user(url) for _ in range(args.clients)]
+
+    spawned = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SRC, "main.py")], cwd=workdir,
+        env=server_env(args, fakes, workdir, port), stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    report = {
+        "commit": commit(),
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": vars(args),
+        "scenarios": {}
+    }
+    try:
+        await wait_for_port(port, process)
+        report["startup_seconds"] = round(time.perf_counter() - spawned, 3)
+
+        clients = [Client(conf) for conf in users]
+        for client in clients:
+            await client.open(url)
+        await clients[0].lookup([f"first-app-{run_id}"])
+        report["first_response_seconds"] = round(time.perf_counter() - spawned, 3)
+        print(f"listening after {report['startup_seconds']}s, "
+              f"first response after {report['first_response_seconds']}s")
+
+        scenarios = build_scenarios(args, run_id)
+        for name in args.scenarios:
+            await warm_up(scenarios[name], clients[0], args)
+            before = fake_stats(fakes)
+            result = await run_scenario(scenarios[name], clients, args)
+            result["upstream"] = stats_delta(fake_stats(fakes), before)
+            report["scenarios"][name] = result
+            latency = result["latency_ms"]
+            print(f"{name:7} {result['requests_per_second']:8.1f} req/s "
+                  f"{result['names_per_second']:8.1f} names/s  "
+                  f"p50 {latency['p50']:7.1f} p95 {latency['p95']:7.1f} p99 {latency['p99']:7.1f} ms  "
+                  f"refused {result['refused']}, failed {result['failed_names']}, "
+                  f"wrong {result['wrong_versions']}")
+
+        for client in clients:
+            await client.close()
+    finally:
+        try:
+            process.communicate(b"exit\n", timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        for fake in [fakes["search"], fakes["safety"], fakes["gpt"], fakes["registry"], *fakes["pages"]]:
+            fake.stop()
+        if args.keep:
+            print(f"Server directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"load-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"Results written to {out}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [s for s in value.split(",") if s in SCENARIOS])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent connections, one user each")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--names-per-request", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="SWUC_WORKERS of the server")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds")
+    parser.add_argument("--safety-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--page-latency", type=float, default=0.1, help="seconds")
+    parser.add_argument("--gpt-latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--registry-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="random extra latency, share of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failed upstream requests")
+    parser.add_argument("--page-hosts", type=int, default=4)
+    parser.add_argument("--pages", help="directory of recorded <slug>.html pages")
+    parser.add_argument("--ambiguous", type=float, default=0.2, help="share of names the GPT fake decides")
+    parser.add_argument("--unsafe", type=float, default=0.0, help="share of URLs reported unsafe")
+    parser.add_argument("--quotas", action="store_true", help="keep the default API quotas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="JSON results file, bench/results/load-<commit>.json by default")
+    parser.add_argument("--keep", action="store_true", help="keep the server's directory and logs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,100 @@
+"""Bytes on the wire and CPU per message of the text and binary protocols.
+
+Each round trip covers what both sides do for one request: the client
+builds and encrypts the request, the server decodes and decrypts it, then
+encrypts the response, and the client decodes and decrypts the response.
+
+Usage: python bench/wire_bench.py [names] [messages]
+"""
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import ecies  # noqa: E402
+from server import wire  # noqa: E402
+from server.crypto import UserKeys, decrypt_bytes_with_key, encrypt_with_key, generate_key_pair  # noqa: E402
+
+NAMES = ["python", "nginx", "openssl", "node.js", "postgresql", "visual studio code",
+         "mozilla firefox", "google chrome", "docker desktop", "7-zip"]
+
+
+def sample_result(name):
+    return {
+        "name": name,
+        "sources": [f"https://www.{name.replace(' ', '')}.org/downloads/{i}/" for i in range(5)],
+        "version": "3.13.3",
+        "error": None,
+        "metadata": {
+            "urls_searched": 5, "urls_analyzed": 5, "analysis_time": "2025-04-20T10:00:00Z",
+            "cached": True, "cache_age": 120, "resolver": "consensus", "resolver_confidence": 0.9
+        }
+    }
+
+
+def text_round_trip(user_id, server_pub, server_keys, client_sec, names, response):
+    # Client
+    raw = "|".join(base64.b64encode(n.encode()).decode() for n in names).encode()
+    request = {"uuid": user_id, "raw": base64.b64encode(ecies.encrypt(server_pub, raw)).decode()}
+    frame = base64.b64encode(json.dumps(request).encode()).decode()
+    sent = len(frame)
+    # Server
+    request = json.loads(base64.b64decode(frame).decode())
+    plain = decrypt_bytes_with_key(server_keys.secret, base64.b64decode(request["raw"])).decode()
+    [base64.b64decode(n).decode() for n in plain.split("|") if n]
+    reply = base64.b64encode(encrypt_with_key(server_keys.public, json.dumps(response).encode())).decode()
+    # Client
+    json.loads(ecies.decrypt(client_sec, base64.b64decode(reply)))
+    return sent, len(reply)
+
+
+def binary_round_trip(user_id, server_pub, server_keys, client_sec, names, response):
+    # Client
+    flags, payload = wire.compress(wire.encode_names(names))
+    frame = wire.pack_request(flags, user_id, ecies.encrypt(server_pub, payload))
+    # Server
+    flags, request_uuid, ciphertext = wire.parse_request(frame)
+    wire.decode_names(wire.decompress(flags, decrypt_bytes_with_key(server_keys.secret, ciphertext)))
+    flags, payload = wire.compress(json.dumps(response).encode())
+    reply = wire.pack_response(flags, encrypt_with_key(server_keys.public, payload))
+    # Client
+    flags, ciphertext = wire.parse_response(reply)
+    json.loads(wire.decompress(flags, ecies.decrypt(client_sec, ciphertext)))
+    return len(frame), len(reply)
+
+
+def measure(func, messages, *args):
+    started = time.process_time()
+    for _ in range(messages):
+        sizes = func(*args)
+    return sizes, (time.process_time() - started) / messages
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    names = [NAMES[i % len(NAMES)] for i in range(count)]
+    response = {"status": "success", "software": [sample_result(name) for name in names]}
+
+    server_secret, server_public = generate_key_pair()
+    client_secret, client_public = generate_key_pair()
+    server_keys = UserKeys({"secret": server_secret, "public_key": client_public})
+    args = (str(uuid.uuid4()), base64.b64decode(server_public), server_keys,
+            base64.b64decode(client_secret), names, response)
+
+    print(f"names per request: {count}, messages: {messages}")
+    results = {}
+    for label, func in (("text", text_round_trip), ("binary", binary_round_trip)):
+        (request_bytes, response_bytes), cpu = measure(func, messages, *args)
+        results[label] = request_bytes + response_bytes
+        print(f"{label:7} request {request_bytes:6} B, response {response_bytes:6} B, "
+              f"{cpu * 1e6:8.1f} us CPU per round trip")
+    print(f"binary/text bytes: {results['binary'] / results['text']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
-import logging
 from dotenv import load_dotenv
 from logging import warning
 import asyncio
 
 import server
+from server import get_from_env
+from services.logs import setup_logging
 
 # Initialization
-logging.basicConfig(filename='server.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
 
 if __name__ == "__main__":
+    # Spawned worker processes import this module too, they set up their own log
+    setup_logging('server.log')
     try:
-        asyncio.run(server.init())
+        workers = get_from_env.get_workers()
+        if workers > 1:
+            server.run_supervisor(workers)
+        else:
+            asyncio.run(server.init())
     except KeyboardInterrupt:
         print("Server stopped by user.")
     except Exception as e:
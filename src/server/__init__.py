@@ -1 +1,2 @@
 from .websock import init
+from .supervisor import run_supervisor
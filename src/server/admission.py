@@ -0,0 +1,127 @@
+import math
+import time
+from contextlib import contextmanager
+from logging import warning
+from typing import Dict, Iterator, Optional
+
+from . import get_from_env
+
+# Initial guess of how long one lookup takes, until real ones are measured
+INITIAL_LOOKUP_SECONDS = 5.0
+
+
+class Rejected(Exception):
+    """A request that is not taken on, the message is sent to the client as is"""
+
+
+class Overloaded(Rejected):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Decides whether a request is taken on before any work is done for it.
+
+    max_lookups names are looked up at once (the VersionFinder semaphore),
+    up to max_queued more may wait for a slot. A request that doesn't fit
+    is rejected as a whole with a retry hint derived from the measured
+    lookup time, instead of making every client wait longer. One UUID may
+    have at most max_per_user names admitted at a time."""
+
+    def __init__(self, max_lookups: int, max_queued: int, max_per_user: int, max_names: int):
+        self.max_lookups = max_lookups
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.max_names = min(max_names, max_per_user)
+        self.admitted = 0
+        self._per_user: Dict[str, int] = {}
+        self._lookup_seconds = INITIAL_LOOKUP_SECONDS
+        self.requests = 0
+        self.rejected = 0
+        self.closed = False
+
+    @property
+    def capacity(self) -> int:
+        return self.max_lookups + self.max_queued
+
+    def _retry_after(self, backlog: int) -> int:
+        # Rounds needed to work off the backlog ahead of the request
+        rounds = max(1, backlog) / self.max_lookups
+        return max(1, math.ceil(rounds * self._lookup_seconds))
+
+    def close(self) -> None:
+        """Refuse every new request, the server is shutting down"""
+        self.closed = True
+
+    def precheck(self, user_id: str) -> None:
+        """Cheap checks before the request is decrypted"""
+        if self.closed:
+            self._reject("server shutting down", self.max_lookups)
+        if self.admitted >= self.capacity:
+            self._reject("server busy", self.admitted - self.capacity + 1)
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            self._reject("too many lookups in flight for this client", self._per_user[user_id])
+
+    def _reject(self, reason: str, backlog: int) -> None:
+        self.rejected += 1
+        retry_after = self._retry_after(backlog)
+        warning(f"Rejected request: {reason}, retry after {retry_after} s")
+        raise Overloaded(reason, retry_after)
+
+    @contextmanager
+    def admit(self, user_id: str, names: int) -> Iterator[None]:
+        """Hold names lookup slots of user_id while the request is processed"""
+        self.requests += 1
+        if names > self.max_names:
+            self.rejected += 1
+            raise Rejected(f"Too many names in request, at most {self.max_names} allowed")
+        if self.closed:
+            self._reject("server shutting down", self.max_lookups)
+        if self.admitted + names > self.capacity:
+            self._reject("server busy", self.admitted + names - self.capacity)
+        in_flight = self._per_user.get(user_id, 0)
+        if in_flight + names > self.max_per_user:
+            self._reject("too many lookups in flight for this client", in_flight)
+
+        self.admitted += names
+        self._per_user[user_id] = in_flight + names
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.admitted -= names
+            left = self._per_user[user_id] - names
+            if left:
+                self._per_user[user_id] = left
+            else:
+                del self._per_user[user_id]
+            if names:
+                # Requests are worked on in parallel, so this is a rough per-name cost
+                per_name = (time.monotonic() - started) * min(names, self.max_lookups) / names
+                self._lookup_seconds = 0.8 * self._lookup_seconds + 0.2 * per_name
+
+    def stats(self) -> Dict:
+        return {
+            "admitted": self.admitted,
+            "capacity": self.capacity,
+            "clients": len(self._per_user),
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "lookup_seconds": round(self._lookup_seconds, 2)
+        }
+
+
+_admission: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(
+            get_from_env.get_max_lookups(),
+            get_from_env.get_max_queued_lookups(),
+            get_from_env.get_max_lookups_per_user(),
+            get_from_env.get_max_names()
+        )
+    return _admission
@@ -1,21 +1,86 @@
 import asyncio
+import contextlib
+import io
 import sys
+import threading
 import uuid
+from typing import Awaitable, Callable, Optional
 
-from .users import get_users, save_users, save_user
+from .users import get_registry, save_user
 from .crypto import generate_key_pair
 
+USERS_PER_PAGE = 50
+
+# Set when the console belongs to the supervisor of worker processes:
+# runs a command in every worker and prints their answers
+forward: Optional[Callable[[str], Awaitable[None]]] = None
+
+# Graceful shutdown of whatever runs the console, called by 'exit'
+shutdown: Optional[Callable[[], None]] = None
+
+# Commands showing or tuning state that lives in each worker process
+WORKER_COMMANDS = ("http", "inflight", "pages", "quota", "load", "stats", "prefetch")
 
 async def start_command_reader():
+    loop = asyncio.get_running_loop()
+    lines: asyncio.Queue = asyncio.Queue()
+
+    def read_stdin() -> None:
+        # A daemon thread, so a pending readline doesn't keep the process alive after exit
+        try:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        except RuntimeError:
+            pass  # The loop is closed, the server has stopped
+
+    threading.Thread(target=read_stdin, name="swuc-console", daemon=True).start()
     while True:
-        # This creates a future that will be set when stdin has data
-        line = await asyncio.to_thread(sys.stdin.readline)
+        line = await lines.get()
+        if line is None:
+            return  # stdin closed, keep serving without a console
         line = line.strip()
 
         if line:
             await process_command(line)
 
 
+async def serve_control(control) -> None:
+    """Run the commands the supervisor forwards over control, a worker's end
+    of a multiprocessing Pipe, and send back what they print"""
+    loop = asyncio.get_running_loop()
+    requests: asyncio.Queue = asyncio.Queue()
+
+    def receive() -> None:
+        # A daemon thread like the console's, recv() blocks until the supervisor writes
+        try:
+            while True:
+                request = control.recv()
+                loop.call_soon_threadsafe(requests.put_nowait, request)
+        except (EOFError, OSError):
+            pass  # The supervisor is gone
+        except RuntimeError:
+            return  # The loop is closed, the worker has stopped
+        loop.call_soon_threadsafe(requests.put_nowait, None)
+
+    threading.Thread(target=receive, name="swuc-control", daemon=True).start()
+    while True:
+        request = await requests.get()
+        if request is None:
+            return
+        sequence, command = request
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                await process_command(command)
+            except Exception as e:
+                print(f"Command failed: {e}")
+        try:
+            control.send((sequence, output.getvalue()))
+        except OSError:
+            return
+
+
 async def process_command(command: str) -> None:
     cmd_parts = command.split()
     if not cmd_parts:
@@ -23,12 +88,23 @@ async def process_command(command: str) -> None:
 
     cmd = cmd_parts[0].lower()
 
+    if forward is not None and cmd in WORKER_COMMANDS:
+        await forward(command)
+        return
+
     if cmd == "help":
         print("Available commands:")
         print("  new - Create new user")
-        print("  list - List all registered users")
+        print("  list [page] - List registered users, 50 per page")
         print("  del <uuid> - Delete a user by UUID")
-        print("  exit - Exit the server")
+        print("  http - Show upstream connection pool statistics")
+        print("  inflight - Show how many identical lookups were coalesced")
+        print("  pages - Show page cache statistics")
+        print("  quota - Show upstream API quota usage")
+        print("  load - Show admitted lookups and rejected requests")
+        print("  stats - Show per-stage latencies, cache hit rates and upstream errors")
+        print("  prefetch [add|del|size|budget|pause|resume] [value] - Show or tune background prefetching")
+        print("  exit - Stop taking requests, finish the ones in progress and exit")
         print("  help - Show this help message")
 
     elif cmd == "new":
@@ -39,13 +115,23 @@ async def process_command(command: str) -> None:
         await generate_user_keys()
 
     elif cmd == "list":
-        users = get_users()
-        if not users:
+        page = 1
+        if len(cmd_parts) > 1:
+            try:
+                page = max(1, int(cmd_parts[1]))
+            except ValueError:
+                print("Usage: list [page]")
+                return
+
+        registry = get_registry()
+        total = registry.count()
+        if not total:
             print("No users registered.")
             return
 
-        print("Registered users:")
-        for user_id, user_data in users.items():
+        pages = (total + USERS_PER_PAGE - 1) // USERS_PER_PAGE
+        print(f"Registered users (page {page}/{pages}, {total} total):")
+        for user_id in registry.page((page - 1) * USERS_PER_PAGE, USERS_PER_PAGE):
             print(f"  UUID: {user_id}")
 
     elif cmd == "del":
@@ -54,19 +140,171 @@ async def process_command(command: str) -> None:
             return
 
         user_id = cmd_parts[1]
-        users = get_users()
-        if user_id in users:
-            del users[user_id]
-            save_users(users)
+        if get_registry().delete(user_id):
             print(f"User {user_id} deleted.")
         else:
             print(f"User {user_id} not found.")
 
+    elif cmd == "http":
+        from services.http_client import get_http_client
+
+        stats = get_http_client().stats()
+        if not stats:
+            print("No upstream requests yet.")
+            return
+
+        print("Upstream connection pools:")
+        for service, pool in stats.items():
+            print(f"  {service}: {pool['requests']} requests, "
+                  f"{pool['connections_opened']} connections opened, "
+                  f"reuse {pool['reuse_rate']:.1%}, "
+                  f"{pool['idle_connections']} idle over {pool['hosts']} hosts")
+
+    elif cmd == "inflight":
+        from services.singleflight import singleflight_stats
+
+        print("Coalesced calls:")
+        for name, flight in singleflight_stats().items():
+            print(f"  {name}: {flight['coalesced']}/{flight['calls']} calls coalesced, "
+                  f"{flight['in_flight']} in flight")
+
+    elif cmd == "pages":
+        from services.page_cache import get_page_cache
+
+        cache = get_page_cache()
+        if cache is None:
+            print("Page cache is disabled.")
+            return
+
+        stats = cache.stats()
+        served = stats["hits"] + stats["revalidated"]
+        total = served + stats["misses"]
+        print(f"Page cache: {stats['pages']} pages, {stats['unique_texts']} unique texts, "
+              f"{stats['stored_bytes']} bytes stored")
+        print(f"  {served}/{total} fetches served from cache "
+              f"({stats['hits']} fresh, {stats['revalidated']} revalidated with 304)")
+        print(f"  {stats['bytes_saved']} bytes not downloaded")
+
+    elif cmd == "quota":
+        from services.quota import quota_stats
+
+        stats = quota_stats()
+        if not stats:
+            print("No upstream API used yet.")
+            return
+
+        print("Upstream API quotas:")
+        for api, quota in stats.items():
+            rate = f"{quota['rate']:g}/s" if quota["rate"] > 0 else "unlimited"
+            print(f"  {api}: {rate}, {quota['tokens']:g}/{quota['burst']:g} tokens, "
+                  f"{quota['granted']} granted, {quota['queued']} queued "
+                  f"(avg {quota['avg_wait']:.3f}s), {quota['timeouts']} timed out, "
+                  f"{quota['throttled']} throttled")
+            waiting = quota["waiting"]
+            if any(waiting.values()) or quota["paused_for"]:
+                print(f"    waiting: {waiting['interactive']} interactive, "
+                      f"{waiting['background']} background, paused for {quota['paused_for']}s")
+
+    elif cmd == "load":
+        from .admission import get_admission
+        from .container import get_container
+
+        container = get_container()
+        first = f"{container.first_response:.2f}s" if container.first_response is not None else "not yet"
+        print(f"Server {container.state}, first response after {first}")
+        stats = get_admission().stats()
+        print(f"Lookups admitted: {stats['admitted']}/{stats['capacity']} "
+              f"from {stats['clients']} clients")
+        print(f"Requests: {stats['requests']}, rejected: {stats['rejected']}, "
+              f"~{stats['lookup_seconds']}s per lookup")
+
+    elif cmd == "stats":
+        from services import metrics
+
+        stages = metrics.STAGE_SECONDS.series()
+        if not stages:
+            print("No requests yet.")
+            return
+
+        print("Stage latencies (ms):")
+        for (stage,), (counts, total) in sorted(stages.items()):
+            count = sum(counts)
+            quantiles = " ".join(
+                f"p{int(q * 100)} {metrics.STAGE_SECONDS.quantile(q, counts) * 1000:.1f}"
+                for q in (0.5, 0.95, 0.99)
+            )
+            print(f"  {stage}: {count} calls, mean {total / count * 1000:.1f}, {quantiles}")
+
+        caches = {}
+        for (cache, result), value in metrics.CACHE_REQUESTS.values().items():
+            caches.setdefault(cache, {"hit": 0, "miss": 0})[result] += value
+        if caches:
+            print("Cache hit rates:")
+            for cache, outcome in sorted(caches.items()):
+                total = outcome["hit"] + outcome["miss"]
+                print(f"  {cache}: {outcome['hit'] / total:.1%} of {int(total)}")
+
+        errors = metrics.UPSTREAM_ERRORS.values()
+        timeouts = metrics.UPSTREAM_TIMEOUTS.values()
+        apis = sorted({key[0] for key in errors} | {key[0] for key in timeouts})
+        if apis:
+            print("Upstream failures:")
+            for api in apis:
+                print(f"  {api}: {int(errors.get((api,), 0))} errors, "
+                      f"{int(timeouts.get((api, 'http'), 0))} timeouts, "
+                      f"{int(timeouts.get((api, 'quota'), 0))} quota timeouts")
+
+        from services.logs import dropped_records
+        if dropped_records():
+            print(f"Log records dropped while the writer was behind: {dropped_records()}")
+
+    elif cmd == "prefetch":
+        from services.prefetch import get_prefetcher
+        from services.result_cache import normalize_name
+
+        prefetcher = get_prefetcher()
+        action = cmd_parts[1].lower() if len(cmd_parts) > 1 else "show"
+        value = " ".join(cmd_parts[2:])
+
+        if action in ("add", "del"):
+            if not value:
+                print(f"Usage: prefetch {action} <name>")
+                return
+            key = normalize_name(value)
+            if action == "add":
+                prefetcher.pinned.add(key)
+                prefetcher.excluded.discard(key)
+                print(f"'{key}' will always be prefetched.")
+            else:
+                prefetcher.pinned.discard(key)
+                prefetcher.excluded.add(key)
+                print(f"'{key}' will not be prefetched.")
+        elif action in ("size", "budget"):
+            try:
+                setattr(prefetcher, action, max(0, int(value)))
+            except ValueError:
+                print(f"Usage: prefetch {action} <number>")
+                return
+            print(f"Prefetch {action} set to {getattr(prefetcher, action)}.")
+        elif action in ("pause", "resume"):
+            prefetcher.paused = action == "pause"
+            print("Prefetching paused." if prefetcher.paused else "Prefetching resumed.")
+        elif action == "show":
+            stats = prefetcher.stats()
+            state = "paused" if stats["paused"] else "running"
+            print(f"Prefetch {state}: top {stats['size']} of {stats['tracked']} tracked names, "
+                  f"{stats['budget_left']}/{stats['budget']} lookups left this hour, "
+                  f"{stats['refreshed']} refreshed, {stats['skipped_busy']} rounds skipped under load")
+            for key in prefetcher.prefetch_set()[:USERS_PER_PAGE]:
+                pinned = " (pinned)" if key in prefetcher.pinned else ""
+                print(f"  {key}: score {prefetcher.score(key):.1f}{pinned}")
+        else:
+            print("Usage: prefetch [add|del|size|budget|pause|resume] [value]")
+
     elif cmd == "exit":
-        print("Shutting down server...")
-        # Signal to stop the server
-        asyncio.get_event_loop().stop()
-        sys.exit()
+        print("Shutting down server, waiting for lookups in progress...")
+        if shutdown is not None:
+            shutdown()
 
     else:
         print(f"Unknown command: {cmd}")
@@ -74,8 +312,16 @@ async def process_command(command: str) -> None:
 
 
 async def generate_user_keys() -> None:
-    import get_from_env
+    from . import get_from_env
 
+    user_conf = provision_user(f"ws://{get_from_env.get_addr()}:{get_from_env.get_port()}")
+    save_user(user_conf["uuid"], user_conf)
+
+    print(f"New user UUID: {user_conf['uuid']}")
+
+
+def provision_user(url: str) -> dict:
+    """Register a new user with fresh key pairs, returns the client's configuration"""
     # Generate server keys
     server_secret, server_public = generate_key_pair()
 
@@ -89,17 +335,12 @@ async def generate_user_keys() -> None:
         "public_key": client_public
     }
     user_conf = {
-        "url": f"ws://{get_from_env.get_addr()}:{get_from_env.get_port()}",
+        "url": url,
         "uuid": user_id,
         "secret": client_secret,
         "public": server_public
     }
 
-    # Save to users.json
-    users = get_users()
-    users[user_id] = server_conf
-    save_users(users)
-
-    save_user(user_id, user_conf)
-
-    print(f"New user UUID: {user_id}")
+    # Save to the user registry
+    get_registry().put(user_id, server_conf)
+    return user_conf
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from logging import info, warning
+from typing import Optional
+
+from . import get_from_env
+from .admission import get_admission
+from .crypto import get_crypto_pool, key_cache
+from .users import get_registry
+from services.metrics import STARTUP_SECONDS
+
+# Startup milestones are measured from here, the server package is imported first thing
+PROCESS_STARTED = time.monotonic()
+
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+
+class Container:
+    """The services of this process, built once and shared by every connection.
+
+    starting -> warming -> ready -> draining -> stopped. Clients are served
+    only once warmup is done; stop() makes the server refuse new requests,
+    wait up to SWUC_DRAIN_TIMEOUT for the admitted ones and shut down."""
+
+    def __init__(self):
+        from services import VersionFinder
+        from services.prefetch import get_prefetcher
+
+        self.state = STARTING
+        self.registry = get_registry()
+        self.admission = get_admission()
+        self.prefetcher = get_prefetcher()
+        self.finder = VersionFinder()
+        self.crypto = get_crypto_pool()
+        self.first_response: Optional[float] = None
+        self._stop = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def _milestone(self, milestone: str) -> float:
+        seconds = time.monotonic() - PROCESS_STARTED
+        STARTUP_SECONDS.set(seconds, milestone=milestone)
+        return seconds
+
+    async def warmup(self) -> None:
+        """Decode user keys, fill caches and open upstream connections before serving"""
+        self.state = WARMING
+        # Decode user keys once, and drop them when a user changes or is deleted
+        self.registry.add_listener(key_cache.invalidate)
+        await asyncio.gather(
+            asyncio.to_thread(key_cache.warm, self.registry, get_from_env.get_key_cache_warm()),
+            asyncio.to_thread(self.finder.warmup)
+        )
+        # Keep the most requested names cached
+        self.prefetcher.start(lambda: self.finder)
+        info("Warmup done after %.2fs", self._milestone("warmup"))
+
+    def serving(self) -> None:
+        self.state = READY
+        info("Ready after %.2fs", self._milestone("ready"))
+
+    def responded(self) -> None:
+        """Called after each response is sent, records the first one"""
+        if self.first_response is None:
+            self.first_response = self._milestone("first_response")
+            info("First response sent %.2fs after start", self.first_response)
+
+    def stop(self) -> None:
+        """Start a graceful shutdown, safe to call more than once"""
+        if self.state in (DRAINING, STOPPED):
+            return
+        info("Shutdown requested, draining %d admitted lookups", self.admission.admitted)
+        self.state = DRAINING
+        self.admission.close()
+        self._stop.set()
+
+    async def wait_stopped(self) -> None:
+        await self._stop.wait()
+
+    async def drain(self) -> None:
+        """Let the admitted lookups finish, then stop the background work"""
+        import services
+
+        deadline = time.monotonic() + get_from_env.get_drain_timeout()
+        while self.admission.admitted and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.admission.admitted:
+            warning("Drain timeout, %d lookups cut off", self.admission.admitted)
+
+        await self.prefetcher.stop()
+        await services.shutdown()
+        self.crypto.shutdown()
+        self.state = STOPPED
+        info("Server stopped")
+
+
+_container: Optional[Container] = None
+
+
+def get_container() -> Container:
+    global _container
+    if _container is None:
+        _container = Container()
+    return _container
@@ -1,5 +1,16 @@
+import asyncio
 import base64
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from logging import info, warning
+from typing import Dict, Optional
+
 import ecies
+from coincurve import PrivateKey, PublicKey
+from ecies.config import ECIES_CONFIG
+from ecies.utils import bytes2pk, decapsulate, encapsulate, sym_decrypt, sym_encrypt
+
+from services.env import env_int, env_str
 
 
 def generate_key_pair():
@@ -20,3 +31,139 @@ def decrypt_data(private_key, encrypted_data):
 
 def encrypt_data(public_key, data):
     return ecies.encrypt(public_key, data)
+
+
+# Same steps as ecies.decrypt/ecies.encrypt, but with already parsed coincurve keys
+def decrypt_with_key(private_key: PrivateKey, encrypted_data: bytes) -> str:
+    return decrypt_bytes_with_key(private_key, encrypted_data).decode("utf-8")
+
+
+def decrypt_bytes_with_key(private_key: PrivateKey, encrypted_data: bytes) -> bytes:
+    config = ECIES_CONFIG
+    key_size = config.ephemeral_key_size
+    ephemeral_pk = PublicKey(encrypted_data[:key_size])
+    sym_key = decapsulate(ephemeral_pk, private_key, config.is_hkdf_key_compressed)
+    return sym_decrypt(
+        sym_key, encrypted_data[key_size:], config.symmetric_algorithm, config.symmetric_nonce_length
+    )
+
+
+def encrypt_with_key(public_key: PublicKey, data: bytes) -> bytes:
+    config = ECIES_CONFIG
+    ephemeral_sk = ecies.utils.generate_key()
+    ephemeral_pk = ephemeral_sk.public_key.format(config.is_ephemeral_key_compressed)
+    sym_key = encapsulate(ephemeral_sk, public_key, config.is_hkdf_key_compressed)
+    return ephemeral_pk + sym_encrypt(
+        sym_key, data, config.symmetric_algorithm, config.symmetric_nonce_length
+    )
+
+
+class UserKeys:
+    """Decoded key material of one user, raw bytes are kept for process pool workers"""
+    __slots__ = ("source", "secret_raw", "public_raw", "secret", "public")
+
+    def __init__(self, user: dict):
+        self.source = (user["secret"], user["public_key"])
+        self.secret_raw = base64.b64decode(user["secret"])
+        self.public_raw = base64.b64decode(user["public_key"])
+        self.secret = PrivateKey(self.secret_raw)
+        self.public = bytes2pk(self.public_raw)
+
+
+class KeyCache:
+    def __init__(self):
+        self._keys: Dict[str, UserKeys] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, user: dict) -> UserKeys:
+        keys = self._keys.get(user_id)
+        # A user edited outside the server gets new keys under the same UUID
+        if keys is None or keys.source != (user["secret"], user["public_key"]):
+            keys = UserKeys(user)
+            with self._lock:
+                self._keys[user_id] = keys
+        return keys
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(user_id, None)
+
+    def warm(self, registry, limit: int) -> int:
+        """Decode keys of up to limit users ahead of their first message"""
+        loaded = 0
+        for user_id in registry.page(0, limit):
+            user = registry.get(user_id)
+            if user is None:
+                continue
+            try:
+                self.get(user_id, user)
+                loaded += 1
+            except Exception as e:
+                warning("Bad keys for user %s: %s", user_id, repr(e))
+        info("Key cache warmed with %d users", loaded)
+        return loaded
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class CryptoPool:
+    """Runs ECIES for payloads of at least offload_bytes on a worker pool instead of the event loop"""
+
+    def __init__(self, kind: str = "thread", workers: int = 2, offload_bytes: int = 65536):
+        self.kind = kind
+        self.offload_bytes = offload_bytes
+        self._executor: Optional[Executor] = None
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="swuc-crypto")
+        elif kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        elif kind != "none":
+            warning(f"Unknown crypto pool type: '{kind}', running crypto inline")
+            self.kind = "none"
+        info("Crypto pool: %s, %d workers, offload from %d bytes", self.kind, workers, offload_bytes)
+
+    def _offload(self, size: int) -> bool:
+        return self._executor is not None and size >= self.offload_bytes
+
+    async def decrypt(self, keys: UserKeys, encrypted_data: bytes) -> str:
+        return (await self.decrypt_bytes(keys, encrypted_data)).decode("utf-8")
+
+    async def decrypt_bytes(self, keys: UserKeys, encrypted_data: bytes) -> bytes:
+        if not self._offload(len(encrypted_data)):
+            return decrypt_bytes_with_key(keys.secret, encrypted_data)
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            # coincurve keys can't be pickled, workers get the raw key bytes
+            return await loop.run_in_executor(self._executor, ecies.decrypt, keys.secret_raw, encrypted_data)
+        return await loop.run_in_executor(self._executor, decrypt_bytes_with_key, keys.secret, encrypted_data)
+
+    async def encrypt(self, keys: UserKeys, data: bytes) -> bytes:
+        if not self._offload(len(data)):
+            return encrypt_with_key(keys.public, data)
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            return await loop.run_in_executor(self._executor, encrypt_data, keys.public_raw, data)
+        return await loop.run_in_executor(self._executor, encrypt_with_key, keys.public, data)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+key_cache = KeyCache()
+_crypto_pool: Optional[CryptoPool] = None
+
+
+def get_crypto_pool() -> CryptoPool:
+    global _crypto_pool
+    if _crypto_pool is None:
+        _crypto_pool = CryptoPool(
+            env_str("SWUC_CRYPTO_POOL", "thread").lower(),
+            max(1, env_int("SWUC_CRYPTO_WORKERS", 2)),
+            env_int("SWUC_CRYPTO_OFFLOAD_BYTES", 65536)
+        )
+    return _crypto_pool
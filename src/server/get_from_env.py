@@ -1,20 +1,57 @@
-import os
-import logging
+from services.env import env_int, env_str, worker_count
+
 
 def get_addr() -> str:
-    addr = os.getenv("SWUC_SERVER_ADDR")
-    if not addr:
-        return "localhost"
-    else:
-        return addr
+    return env_str("SWUC_SERVER_ADDR", "localhost")
 
 
 def get_port() -> int:
-    port = os.getenv("SWUC_SERVER_PORT")
-    try:
-        port = int(port) if port is not None else 8765
-    except ValueError:
-        logging.warning(f"Incorrect port value: '{port}', using default 8765")
-        port = 8765
-
-    return port
+    return env_int("SWUC_SERVER_PORT", 8765)
+
+
+def get_key_cache_warm() -> int:
+    return env_int("SWUC_KEY_CACHE_WARM", 10000)
+
+
+def _get_limit(name: str, default: int) -> int:
+    return max(1, env_int(name, default))
+
+
+def get_max_connections() -> int:
+    return _get_limit("SWUC_MAX_CONNECTIONS", 1000)
+
+
+def get_max_frame_bytes() -> int:
+    return _get_limit("SWUC_MAX_FRAME_BYTES", 1024 * 1024)
+
+
+def get_max_names() -> int:
+    return _get_limit("SWUC_MAX_NAMES_PER_REQUEST", 100)
+
+
+def get_max_lookups() -> int:
+    return _get_limit("SWUC_MAX_CONCURRENT_LOOKUPS", 8)
+
+
+def get_max_queued_lookups() -> int:
+    return _get_limit("SWUC_MAX_QUEUED_LOOKUPS", 200)
+
+
+def get_max_lookups_per_user() -> int:
+    return _get_limit("SWUC_MAX_LOOKUPS_PER_USER", 100)
+
+
+def get_workers() -> int:
+    return worker_count()
+
+
+def get_metrics_addr() -> str:
+    return env_str("SWUC_METRICS_ADDR", "127.0.0.1")
+
+
+def get_metrics_port() -> int:
+    return env_int("SWUC_METRICS_PORT", 9108)
+
+
+def get_drain_timeout() -> int:
+    return _get_limit("SWUC_DRAIN_TIMEOUT", 30)
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import signal
+import textwrap
+import time
+from logging import info, warning
+from multiprocessing.connection import Connection
+from typing import Dict, Optional
+
+from . import commands
+from . import get_from_env
+from .users import get_registry
+
+# Seconds between checks for workers that died
+WATCH_INTERVAL = 1.0
+# Seconds a worker has to answer a forwarded console command
+COMMAND_TIMEOUT = 5.0
+
+
+def _worker_main(index: int, control: Connection) -> None:
+    """Entry point of a worker process"""
+    # Registry changes (SIGHUP) wait until init has a handler for them, the
+    # default action would kill the worker. Blocked across spawn already
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGHUP})
+    from dotenv import load_dotenv
+    from services.logs import setup_logging
+    from .websock import init
+
+    load_dotenv()
+    setup_logging("server.log", worker=index)
+    # Ctrl+C in the console is the supervisor's business
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    info(f"Worker {index} started with pid {os.getpid()}")
+    asyncio.run(init(worker=index, control=control))
+
+
+class Supervisor:
+    """Runs the console and keeps `workers` server processes alive. The
+    workers listen on the same address and port with SO_REUSEPORT, so the
+    kernel spreads connections over them, and share caches through SQLite."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        # Supervisor ends of the pipes console commands are forwarded over
+        self._controls: Dict[int, Connection] = {}
+        self._sequence = itertools.count()
+        self._stop = asyncio.Event()
+
+    def _start(self, index: int) -> None:
+        control, worker_control = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(index, worker_control), name=f"swuc-worker-{index}", daemon=True
+        )
+        # The worker inherits the blocked SIGHUP from its first instruction on
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGHUP})
+        try:
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+        worker_control.close()
+        if index in self._controls:
+            self._controls[index].close()
+        self._controls[index] = control
+        self._processes[index] = process
+
+    def notify_workers(self, user_id: Optional[str] = None) -> None:
+        """Make every worker re-read the user registry now"""
+        for process in self._processes.values():
+            if process.is_alive():
+                try:
+                    os.kill(process.pid, signal.SIGHUP)
+                except ProcessLookupError:
+                    pass
+
+    async def forward(self, command: str) -> None:
+        """Run a console command in every worker, and print their answers"""
+        sequence = next(self._sequence)
+        indexes = sorted(self._processes)
+        answers = await asyncio.gather(
+            *(asyncio.to_thread(self._ask, index, sequence, command) for index in indexes)
+        )
+        for index, answer in zip(indexes, answers):
+            print(f"Worker {index}:")
+            print(textwrap.indent(answer.rstrip("\n"), "  ") if answer is not None else "  no answer")
+
+    def _ask(self, index: int, sequence: int, command: str) -> Optional[str]:
+        """What worker index printed for command. Answers to earlier commands
+        that came too late are skipped"""
+        control = self._controls[index]
+        if not self._processes[index].is_alive():
+            return None
+        try:
+            control.send((sequence, command))
+            deadline = time.monotonic() + COMMAND_TIMEOUT
+            while control.poll(max(0.0, deadline - time.monotonic())):
+                answered, output = control.recv()
+                if answered == sequence:
+                    return output
+        except (EOFError, OSError):
+            pass
+        return None
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _shutdown(self) -> None:
+        """Let every worker drain its lookups, then make sure they are gone"""
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        # A worker waits at most the drain timeout, plus time to wind down
+        wait = get_from_env.get_drain_timeout() + 5
+        for index, process in self._processes.items():
+            await asyncio.to_thread(process.join, wait)
+            if process.is_alive():
+                warning(f"Worker {index} did not stop, killing it")
+                process.kill()
+        for control in self._controls.values():
+            control.close()
+        info("All workers stopped")
+
+    async def run(self) -> None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+        # Workers learn about users added or deleted from the console right away
+        get_registry().add_listener(self.notify_workers)
+        for index in range(self.workers):
+            self._start(index)
+
+        commands.shutdown = self.stop
+        commands.forward = self.forward
+        asyncio.create_task(commands.start_command_reader())
+        print(f"Server starting with {self.workers} workers! Type 'help' for available commands.")
+
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), WATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            for index, process in list(self._processes.items()):
+                if not process.is_alive() and not self._stop.is_set():
+                    warning(f"Worker {index} exited with code {process.exitcode}, restarting it")
+                    self._start(index)
+        await self._shutdown()
+
+
+def run_supervisor(workers: Optional[int] = None) -> None:
+    supervisor = Supervisor(workers or get_from_env.get_workers())
+    asyncio.run(supervisor.run())
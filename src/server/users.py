@@ -1,33 +1,273 @@
 import json
 import os
-from logging import warning
+import sqlite3
+import tempfile
+import threading
+import time
+from logging import info, warning
+from typing import Callable, Dict, List, Optional
 
-def get_users() -> dict:
-    try:
-        if not os.path.exists("users.json"):
-            with open("users.json", "w") as f:
-                json.dump({}, f)
-
-        with open("users.json", "r") as users_file:
-            return json.load(users_file)
-    except json.JSONDecodeError:
-        return {}
-    except Exception as e:
-        warning(f"Error loading users: {repr(e)}")
-        return {}
+from services.env import env_float, env_str
+
+# Users read per query when memoized users are checked again
+SQLITE_CHUNK = 500
 
-def save_users(users: dict) -> None:
+
+def atomic_write_json(path: str, data) -> None:
+    """Write JSON next to the target and rename it over, so readers never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
     try:
-        with open("users.json", "w") as users_file:
-            json.dump(users, users_file, indent=2)
-    except Exception as e:
-        warning(f"Error saving users: {repr(e)}")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(data, tmp_file, indent=2)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _Listeners:
+    """Callbacks run with the id of each user put, deleted, or changed by
+    another process (found on reload)"""
+
+    def add_listener(self, callback: Callable[[Optional[str]], None]) -> None:
+        self._listeners.append(callback)
+
+    def _notify(self, user_id: Optional[str]) -> None:
+        for callback in self._listeners:
+            try:
+                callback(user_id)
+            except Exception as e:
+                warning(f"User registry listener failed: {repr(e)}")
+
+
+class JsonUserStore(_Listeners):
+    """All users in one JSON file, held in memory and reloaded when the file's mtime changes"""
+
+    def __init__(self, path: str = "users.json", check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._listeners = []
+        self._users: Dict[str, dict] = {}
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self.reload()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def reload(self) -> bool:
+        """Re-read the file if it changed since the last load, returns True when it did"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            stamp = self._file_stamp()
+            if stamp == self._stamp and stamp is not None:
+                return False
+
+            previous = self._users
+            if stamp is None:
+                self._save({})
+            else:
+                try:
+                    with open(self.path, "r") as users_file:
+                        self._users = json.load(users_file)
+                except json.JSONDecodeError:
+                    warning("Bad JSON in %s, keeping %d loaded users", self.path, len(self._users))
+                except Exception as e:
+                    warning(f"Error loading users: {repr(e)}")
+                self._stamp = stamp
+                info("Loaded %d users from %s", len(self._users), self.path)
+            changed = [user_id for user_id in previous.keys() | self._users.keys()
+                       if previous.get(user_id) != self._users.get(user_id)]
+        for user_id in changed:
+            self._notify(user_id)
+        return True
+
+    def _maybe_reload(self) -> None:
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+
+    def _save(self, users: Dict[str, dict]) -> None:
+        try:
+            atomic_write_json(self.path, users)
+            self._users = users
+            self._stamp = self._file_stamp()
+        except Exception as e:
+            warning(f"Error saving users: {repr(e)}")
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            self._maybe_reload()
+            return self._users.get(user_id)
+
+    def put(self, user_id: str, user: dict) -> None:
+        with self._lock:
+            self.reload()
+            users = dict(self._users)
+            users[user_id] = user
+            self._save(users)
+        self._notify(user_id)
+
+    def delete(self, user_id: str) -> bool:
+        with self._lock:
+            self.reload()
+            if user_id not in self._users:
+                return False
+            users = dict(self._users)
+            del users[user_id]
+            self._save(users)
+        self._notify(user_id)
+        return True
+
+    def count(self) -> int:
+        with self._lock:
+            self._maybe_reload()
+            return len(self._users)
+
+    def page(self, offset: int, limit: int) -> List[str]:
+        with self._lock:
+            self._maybe_reload()
+            return sorted(self._users)[offset:offset + limit]
+
+
+class SqliteUserStore(_Listeners):
+    """Users in an SQLite table, looked up by primary key and memoized until the database changes"""
+
+    def __init__(self, path: str = "users.db", import_from: Optional[str] = "users.json"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._memo: Dict[str, Optional[dict]] = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users (uuid TEXT PRIMARY KEY, conf TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._data_version = self._get_data_version()
+
+        if import_from and os.path.exists(import_from) and self.count() == 0:
+            self._import_json(import_from)
+
+    def _import_json(self, path: str) -> None:
+        try:
+            with open(path, "r") as users_file:
+                users = json.load(users_file)
+        except Exception as e:
+            warning(f"Error importing users from {path}: {repr(e)}")
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO users (uuid, conf) VALUES (?, ?)",
+                [(user_id, json.dumps(conf)) for user_id, conf in users.items()]
+            )
+            self._db.commit()
+        info("Imported %d users from %s into %s", len(users), path, self.path)
+
+    def _get_data_version(self) -> int:
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def reload(self) -> bool:
+        """Re-read memoized users if another connection committed since the
+        last check, returns True when it did"""
+        with self._lock:
+            version = self._get_data_version()
+            if version == self._data_version:
+                return False
+            self._data_version = version
+            changed = self._refresh_memo()
+        for user_id in changed:
+            self._notify(user_id)
+        return True
+
+    def _refresh_memo(self) -> List[str]:
+        """Ids of the memoized users that were changed, added or deleted meanwhile"""
+        user_ids = list(self._memo)
+        current: Dict[str, dict] = {}
+        for start in range(0, len(user_ids), SQLITE_CHUNK):
+            chunk = user_ids[start:start + SQLITE_CHUNK]
+            rows = self._db.execute(
+                f"SELECT uuid, conf FROM users WHERE uuid IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            current.update((user_id, json.loads(conf)) for user_id, conf in rows)
+        changed = [user_id for user_id in user_ids if current.get(user_id) != self._memo[user_id]]
+        for user_id in changed:
+            self._memo[user_id] = current.get(user_id)
+        return changed
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            self.reload()
+            if user_id not in self._memo:
+                row = self._db.execute(
+                    "SELECT conf FROM users WHERE uuid = ?", (user_id,)
+                ).fetchone()
+                self._memo[user_id] = json.loads(row[0]) if row else None
+            return self._memo[user_id]
+
+    def put(self, user_id: str, user: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO users (uuid, conf) VALUES (?, ?)",
+                (user_id, json.dumps(user))
+            )
+            self._db.commit()
+            self._memo[user_id] = user
+        self._notify(user_id)
+
+    def delete(self, user_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM users WHERE uuid = ?", (user_id,))
+            self._db.commit()
+            self._memo.pop(user_id, None)
+        self._notify(user_id)
+        return cursor.rowcount > 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def page(self, offset: int, limit: int) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uuid FROM users ORDER BY uuid LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+            return [row[0] for row in rows]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide user store, the backend is picked by SWUC_USERS_BACKEND (json or sqlite)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            backend = env_str("SWUC_USERS_BACKEND", "json").lower()
+            if backend == "sqlite":
+                _registry = SqliteUserStore(env_str("SWUC_USERS_PATH", "users.db"))
+            else:
+                if backend != "json":
+                    warning(f"Unknown users backend: '{backend}', using json")
+                _registry = JsonUserStore(
+                    env_str("SWUC_USERS_PATH", "users.json"), env_float("SWUC_USERS_RELOAD_INTERVAL", 1.0)
+                )
+        return _registry
+
 
 def save_user(uuid: str, user: dict) -> None:
     if not os.path.exists("users"):
         os.makedirs("users")
     try:
-        with open(f"users/{uuid}.json", "w") as users_file:
-            json.dump(user, users_file, indent=2)
+        atomic_write_json(f"users/{uuid}.json", user)
     except Exception as e:
         warning(f"Error saving user: {repr(e)}")
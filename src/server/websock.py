@@ -1,15 +1,28 @@
 from websockets.asyncio.server import serve
 from logging import info, warning
+from typing import Optional
 import base64
 import json
 import asyncio
+import signal
 
-from .crypto import decrypt_data, encrypt_data
-from .users import get_users
+from .container import get_container
+from .crypto import key_cache, get_crypto_pool
+from .users import get_registry
 from . import get_from_env
 from . import commands
-
-async def init() -> None:
+from . import wire
+from .admission import Rejected, get_admission
+from services.metrics import REQUESTS, start_metrics_server, timed
+from services.logs import Payload
+
+# Open client connections, bounded by SWUC_MAX_CONNECTIONS
+_connections = 0
+
+async def init(worker: Optional[int] = None, control=None) -> None:
+    """Run the server until it is stopped. A worker started by the supervisor
+    shares the port with its siblings, serves metrics on its own port and has
+    no console, it runs the commands the supervisor forwards over control"""
     # Getting info from environment
     addr = get_from_env.get_addr()
     info(f"Using address: {addr}")
@@ -17,76 +30,133 @@ async def init() -> None:
     port = get_from_env.get_port()
     info(f"Using port: {port}")
 
-    # Start command reader task
-    asyncio.create_task(commands.start_command_reader())
+    container = get_container()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, container.stop)
+    if worker is not None:
+        # The supervisor signals registry changes made from its console. They
+        # were blocked until now, one sent during startup is delivered here
+        loop.add_signal_handler(signal.SIGHUP, container.registry.reload)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGHUP})
+    if control is not None:
+        asyncio.create_task(commands.serve_control(control))
+
+    metrics_port = get_from_env.get_metrics_port()
+    if worker is not None and metrics_port:
+        metrics_port += worker
+    await start_metrics_server(get_from_env.get_metrics_addr(), metrics_port, lambda: container.ready)
+
+    await container.warmup()
+
+    if worker is None:
+        # Start command reader task
+        commands.shutdown = container.stop
+        asyncio.create_task(commands.start_command_reader())
 
-    print("Server starting! Type 'help' for available commands.")
+        print("Server starting! Type 'help' for available commands.")
 
-    # Start serving
-    await start_websocket_server(addr, port)
+    # Serve until stopped
+    await start_websocket_server(addr, port, reuse_port=worker is not None)
 
 async def handler(websocket) -> None:
+    global _connections
+    if _connections >= get_from_env.get_max_connections():
+        warning("Refusing connection, too many open")
+        await websocket.close(1013, "Overloaded, retry later")
+        return
+
+    _connections += 1
     try:
         async for message in websocket:
-            info(f"Received msg: {message}")
-            response = await process(message)
-            await websocket.send(response)
-            info(f"Sent msg: {response}")
+            info("Received msg: %s", Payload(message))
+            response = await process(message, websocket.send)
+            with timed("send", lookup=False):
+                await websocket.send(response)
+            info("Sent msg: %s", Payload(response))
+            get_container().responded()
     except Exception as e:
         warning(f"Handler error: {repr(e)}")
+    finally:
+        _connections -= 1
 
 
-async def start_websocket_server(addr: str, port: int) -> None:
-    async with serve(handler, addr, port) as server:
-        await server.serve_forever()
+async def encrypt_frame(keys, response: dict) -> str:
+    response_json = json.dumps(response)
 
+    # Encrypt response with client's public key
+    with timed("encrypt", lookup=False):
+        encrypted_response = await get_crypto_pool().encrypt(keys, response_json.encode("utf-8"))
 
-async def process(message: str) -> str:
-    users = get_users()
+    # Return base64-encoded encrypted response
+    return base64.b64encode(encrypted_response).decode("utf-8")
 
-    try:
-        # Decode base64 message and parse JSON
-        json_request = base64.b64decode(message).decode("utf-8")
-        request = json.loads(json_request)
-        info(f"Request: {request}")
 
-        # Validate UUID
-        if "uuid" not in request or request["uuid"] not in users:
-            return "Invalid UUID"
+async def encrypt_binary_frame(keys, response: dict) -> bytes:
+    with timed("encrypt", lookup=False):
+        flags, payload = wire.compress(json.dumps(response).encode("utf-8"))
+        return wire.pack_response(flags, await get_crypto_pool().encrypt(keys, payload))
 
-        # Decrypt incoming data with server's private key
-        encrypted_names = base64.b64decode(request["raw"])
-        server_private_key = base64.b64decode(users[request["uuid"]]["secret"])
 
-        decrypted_names = decrypt_data(server_private_key, encrypted_names)
+async def start_websocket_server(addr: str, port: int, reuse_port: bool = False) -> None:
+    """Serve until the container is stopped, then drain and close the connections"""
+    container = get_container()
+    async with serve(handler, addr, port, max_size=get_from_env.get_max_frame_bytes(),
+                     reuse_port=reuse_port):
+        container.serving()
+        await container.wait_stopped()
+        await container.drain()
 
-        # Process decrypted names
-        result = []
-        for encoded_name in decrypted_names.split("|"):
-            if encoded_name:  # Check for empty strings
-                import sys
-                from os import path
-                sys.path.append(path.join(path.dirname(__file__), '..'))
-                from services import VersionFinder
 
-                finder = VersionFinder()
+async def process(message, send=None):
+    """Handle one request and return the response frame.
 
-                name = base64.b64decode(encoded_name).decode("utf-8")
+    Binary frames use the protocol in wire.py, text frames the base64/JSON one.
+    A request asking for streaming ("stream": true, or FLAG_STREAM) gets every
+    software result as its own encrypted frame through send, as soon as it is
+    ready, and the returned frame is only a summary. Without it the whole list
+    comes in one frame."""
+    if isinstance(message, bytes):
+        return await process_binary(message, send)
 
-                res = finder.find_version(name)
+    registry = get_registry()
+    outcome = "error"
 
-                result.append(res)
+    try:
+        # Decode base64 message and parse JSON
+        with timed("decode", lookup=False):
+            json_request = base64.b64decode(message).decode("utf-8")
+            request = json.loads(json_request)
+        info("Request from %s: %s", request.get("uuid"), Payload(json_request))
 
-        # Prepare JSON response
-        response_json = json.dumps({"status": "success", "software": result})
+        # Validate UUID
+        user = registry.get(request["uuid"]) if "uuid" in request else None
+        if user is None:
+            return "Invalid UUID"
+        admission = get_admission()
+        admission.precheck(request["uuid"])
+
+        # Decrypt incoming data with server's private key
+        keys = key_cache.get(request["uuid"], user)
+        encrypted_names = base64.b64decode(request["raw"])
 
-        # Encrypt response with client's public key
-        client_public_key = base64.b64decode(users[request["uuid"]]["public_key"])
-        encrypted_response = encrypt_data(client_public_key, response_json.encode("utf-8"))
+        with timed("decrypt", lookup=False):
+            decrypted_names = await get_crypto_pool().decrypt(keys, encrypted_names)
 
-        # Return base64-encoded encrypted response
-        return base64.b64encode(encrypted_response).decode("utf-8")
+        names = [
+            base64.b64decode(encoded_name).decode("utf-8")
+            for encoded_name in decrypted_names.split("|")
+            if encoded_name  # Check for empty strings
+        ]
 
+        stream = request.get("stream") is True
+        with admission.admit(request["uuid"], len(names)):
+            response = await respond(keys, names, stream, send, encrypt_frame)
+        outcome = "ok"
+        return response
+
+    except Rejected as e:
+        outcome = "rejected"
+        return str(e)
     except json.JSONDecodeError:
         return "Bad JSON in request"
     except KeyError:
@@ -97,3 +167,63 @@ async def process(message: str) -> str:
         return f"Processing error: {str(e)}"
     except Exception as e:
         return f"Error: {repr(e)}"
+    finally:
+        REQUESTS.inc(protocol="text", outcome=outcome)
+
+
+async def process_binary(frame: bytes, send=None):
+    outcome = "error"
+    try:
+        flags, user_id, ciphertext = wire.parse_request(frame)
+        info("Binary request from %s, flags %#04x", user_id, flags)
+
+        # Validate UUID
+        user = get_registry().get(user_id)
+        if user is None:
+            return "Invalid UUID"
+        admission = get_admission()
+        admission.precheck(user_id)
+
+        keys = key_cache.get(user_id, user)
+        with timed("decrypt", lookup=False):
+            plaintext = await get_crypto_pool().decrypt_bytes(keys, ciphertext)
+        with timed("decode", lookup=False):
+            names = wire.decode_names(wire.decompress(flags, plaintext))
+
+        stream = bool(flags & wire.FLAG_STREAM)
+        with admission.admit(user_id, len(names)):
+            response = await respond(keys, names, stream, send, encrypt_binary_frame)
+        outcome = "ok"
+        return response
+
+    except Rejected as e:
+        outcome = "rejected"
+        return str(e)
+    except wire.WireError as e:
+        return f"Bad binary frame: {str(e)}"
+    except Exception as e:
+        return f"Error: {repr(e)}"
+    finally:
+        REQUESTS.inc(protocol="binary", outcome=outcome)
+
+
+async def respond(keys, names, stream: bool, send, encode):
+    # Process decrypted names
+    finder = get_container().finder
+
+    if stream and send is not None:
+        failed = 0
+        async for index, item in finder.iter_versions(names):
+            if item["error"]:
+                failed += 1
+            await send(await encode(
+                keys, {"status": "item", "index": index, "software": item}
+            ))
+        return await encode(
+            keys, {"status": "done", "count": len(names), "failed": failed}
+        )
+
+    result = await finder.find_versions(names)
+
+    # Prepare JSON response
+    return await encode(keys, {"status": "success", "software": result})
@@ -0,0 +1,87 @@
+"""Binary protocol, used for binary WebSocket frames.
+
+Request frame:  version (1 byte) | flags (1 byte) | uuid (16 bytes) | ECIES(plaintext)
+Response frame: version (1 byte) | flags (1 byte) | ECIES(plaintext)
+
+A request plaintext is the UTF-8 software names separated by newlines, a
+response plaintext is the same JSON the text protocol sends. Plaintexts
+with FLAG_COMPRESSED are zlib-compressed before encryption. FLAG_STREAM in
+a request asks for streaming mode. Text frames keep the legacy base64/JSON
+protocol, errors are always sent as text frames.
+"""
+import struct
+import uuid
+import zlib
+from typing import List, Tuple
+
+PROTOCOL_VERSION = 2
+SUPPORTED_VERSIONS = (PROTOCOL_VERSION,)
+
+FLAG_COMPRESSED = 0x01
+FLAG_STREAM = 0x02
+
+REQUEST_HEADER = struct.Struct("!BB16s")
+RESPONSE_HEADER = struct.Struct("!BB")
+
+# Below this size zlib output is usually not smaller than the input
+COMPRESS_MIN_BYTES = 128
+MAX_PLAINTEXT_BYTES = 1024 * 1024
+
+
+class WireError(ValueError):
+    pass
+
+
+def parse_request(frame: bytes) -> Tuple[int, str, bytes]:
+    """Return (flags, uuid, ciphertext) of a binary request frame"""
+    if len(frame) <= REQUEST_HEADER.size:
+        raise WireError("Truncated binary frame")
+    version, flags, raw_uuid = REQUEST_HEADER.unpack_from(frame)
+    if version not in SUPPORTED_VERSIONS:
+        raise WireError(f"Unsupported protocol version {version}")
+    return flags, str(uuid.UUID(bytes=raw_uuid)), frame[REQUEST_HEADER.size:]
+
+
+def pack_request(flags: int, user_id: str, ciphertext: bytes) -> bytes:
+    return REQUEST_HEADER.pack(PROTOCOL_VERSION, flags, uuid.UUID(user_id).bytes) + ciphertext
+
+
+def pack_response(flags: int, ciphertext: bytes) -> bytes:
+    return RESPONSE_HEADER.pack(PROTOCOL_VERSION, flags) + ciphertext
+
+
+def parse_response(frame: bytes) -> Tuple[int, bytes]:
+    version, flags = RESPONSE_HEADER.unpack_from(frame)
+    if version not in SUPPORTED_VERSIONS:
+        raise WireError(f"Unsupported protocol version {version}")
+    return flags, frame[RESPONSE_HEADER.size:]
+
+
+def compress(plaintext: bytes) -> Tuple[int, bytes]:
+    """Return (flags, payload), compressing only when it pays off"""
+    if len(plaintext) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(plaintext, 6)
+        if len(packed) < len(plaintext):
+            return FLAG_COMPRESSED, packed
+    return 0, plaintext
+
+
+def decompress(flags: int, payload: bytes) -> bytes:
+    if not flags & FLAG_COMPRESSED:
+        return payload
+    inflater = zlib.decompressobj()
+    try:
+        plaintext = inflater.decompress(payload, MAX_PLAINTEXT_BYTES)
+    except zlib.error as e:
+        raise WireError(f"Bad compressed payload: {e}")
+    if inflater.unconsumed_tail:
+        raise WireError("Decompressed payload too large")
+    return plaintext
+
+
+def encode_names(names: List[str]) -> bytes:
+    return "\n".join(names).encode("utf-8")
+
+
+def decode_names(plaintext: bytes) -> List[str]:
+    return [name for name in plaintext.decode("utf-8").split("\n") if name]
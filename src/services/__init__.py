@@ -2,11 +2,73 @@ from .search_manager import SearchManager
 from .safety_checker import SafetyChecker
 from .content_extractor import ContentExtractor
 from .content_analyzer import ContentAnalyzer
+from .sources import Found, get_source_registry
+from .result_cache import get_cache_executor, get_result_cache, normalize_name, shutdown_cache_executor, FRESH
+from .singleflight import AsyncSingleFlight
+from .prefetch import get_prefetcher
+from .quota import BACKGROUND, INTERACTIVE, QuotaTimeout, priority
+from .metrics import cache_result, observe, start_lookup_timings, timed
+from .env import env_int
 
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import asyncio
+import contextlib
+import contextvars
+import copy
+import functools
 import os
-from logging import info, error
-from typing import List
+import time
+from datetime import datetime, timezone
+from logging import debug, info, warning, error
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+# Shared between every VersionFinder so the limits hold across connections
+_lookup_semaphore: Optional[asyncio.Semaphore] = None
+# Background lookups also take one of these first, so most slots stay free for clients
+_background_semaphore: Optional[asyncio.Semaphore] = None
+_executor: Optional[ThreadPoolExecutor] = None
+# Names with a stale-while-revalidate refresh already running, and their tasks
+_refreshing: Set[str] = set()
+_refresh_tasks: Set[asyncio.Task] = set()
+# Concurrent lookups of the same name, from any connection, share one computation
+_lookup_flight = AsyncSingleFlight("find_version")
+# How often a worker checks whether another worker's lookup has finished
+PEER_POLL_INTERVAL = 0.1
+
+
+def _get_lookup_semaphore(limit: int) -> asyncio.Semaphore:
+    global _lookup_semaphore
+    if _lookup_semaphore is None:
+        _lookup_semaphore = asyncio.Semaphore(limit)
+    return _lookup_semaphore
+
+
+def _get_background_semaphore(limit: int) -> asyncio.Semaphore:
+    global _background_semaphore
+    if _background_semaphore is None:
+        _background_semaphore = asyncio.Semaphore(limit)
+    return _background_semaphore
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="swuc-lookup")
+    return _executor
+
+
+async def shutdown() -> None:
+    """Stop background refreshes and the lookup threads, after the last client lookup"""
+    global _executor
+    for task in list(_refresh_tasks):
+        task.cancel()
+    await asyncio.gather(*_refresh_tasks, return_exceptions=True)
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    shutdown_cache_executor()
+
 
 class VersionFinder:
     def __init__(self):
@@ -16,9 +78,15 @@ class VersionFinder:
             "folder_id": os.getenv("YANDEX_FOLDER_ID", ""),
             "search_api_key": os.getenv("YANDEX_SEARCH_API_KEY", ""),
             "safety_api_key": os.getenv("YANDEX_SAFE_BROWSING_API_KEY", ""),
-            "gpt_api_key": os.getenv("YANDEX_GPT_API_KEY", "")
+            "gpt_api_key": os.getenv("YANDEX_GPT_API_KEY", ""),
+            "max_concurrent_lookups": max(1, env_int("SWUC_MAX_CONCURRENT_LOOKUPS", 8)),
+            "max_fetches_per_lookup": max(1, env_int("SWUC_MAX_FETCHES_PER_LOOKUP", 5)),
+            "max_pending_refreshes": max(1, env_int("SWUC_MAX_PENDING_REFRESHES", 32))
         }
-        
+        self.config["max_background_lookups"] = max(1, env_int(
+            "SWUC_MAX_BACKGROUND_LOOKUPS", self.config["max_concurrent_lookups"] // 4
+        ))
+
         self.search = SearchManager(
             self.config["folder_id"],
             self.config["search_api_key"]
@@ -29,10 +97,28 @@ class VersionFinder:
             self.config["folder_id"],
             self.config["gpt_api_key"]
         )
+        self.cache = get_result_cache()
+        self.sources = get_source_registry()
 
-    def find_version(self, software_name: str, max_results: int = 5):
-        """Full version search workflow with structured JSON output"""
-        response_template = {
+    def warmup(self) -> None:
+        """Compile patterns, load persisted searches into memory and open a
+        connection to every configured API, so the first lookup pays for none of it"""
+        self.analyzer.warmup()
+        loaded = self.search.cache.preload()
+        opened = []
+        for name, client, url, enabled in (
+            ("search", self.search.http, self.search.url, bool(self.config["search_api_key"])),
+            ("safety", self.safety.http, self.safety.url, self.safety.enabled),
+            ("gpt", self.analyzer.http, self.analyzer.api_url, bool(self.config["gpt_api_key"]))
+        ):
+            if enabled and client.warm(url):
+                opened.append(name)
+        info("VersionFinder warmed up: %d searches preloaded, connections to %s",
+             loaded, ", ".join(opened) or "no API")
+
+    @staticmethod
+    def _new_response(software_name: str) -> Dict:
+        return {
             "name": software_name,
             "sources": [],
             "version": None,
@@ -43,51 +129,282 @@ class VersionFinder:
                 "analysis_time": None
             }
         }
-        
+
+    def find_version(self, software_name: str, max_results: int = 5):
+        """Full version search workflow with structured JSON output, uncached.
+        Blocking, for scripts; not to be called from a running event loop"""
+        return asyncio.run(self._lookup_timed(software_name, max_results))
+
+    async def find_version_async(self, software_name: str, max_results: int = 5):
+        """Cached find_version: fresh entries are returned as is, stale ones are
+        returned right away while a refresh runs in the background"""
+        prefetcher = get_prefetcher()
+        prefetcher.record(software_name)
+        started = time.perf_counter()
+        cached = await self._run_cache(self.cache.get, software_name)
+        cache_result("result", cached is not None)
+        if cached is not None:
+            result, age, state = cached
+            if state != FRESH:
+                self._schedule_refresh(software_name, max_results)
+            return self._from_cache(software_name, result, age, time.perf_counter() - started)
+
+        prefetcher.lookup_started(self.config["max_concurrent_lookups"])
         try:
-            # Step 1: Search for URLs
-            info("Searching for URLs...")
-            urls = self.search.search_urls(
-                f"{software_name} latest version",
-                max_results
-            )
-            response_template["metadata"]["urls_searched"] = len(urls)
-            
-            if not urls:
-                response_template["error"] = "No search results found"
-                return response_template
+            result = await self._lookup_shared(software_name, max_results)
+        finally:
+            prefetcher.lookup_finished()
+        result = copy.deepcopy(result)
+        result["name"] = software_name
+        return self._with_cache_metadata(result, False, 0)
+
+    async def _lookup_shared(self, software_name: str, max_results: int) -> Dict:
+        async def lookup():
+            if self.cache.shared and not await self._run_cache(self.cache.claim, software_name):
+                result = await self._wait_for_peer(software_name)
+                if result is not None:
+                    return result
+
+            try:
+                result = await self._lookup_timed(software_name, max_results)
+                if "retry_after" not in result["metadata"]:
+                    await self._run_cache(self.cache.set, software_name, result)
+                return result
+            finally:
+                if self.cache.shared:
+                    await self._run_cache(self.cache.release, software_name)
+
+        # A flight runs at the priority of whoever started it, so clients never
+        # join a background one and wait behind its quota; background callers
+        # may join a client's flight
+        key = (normalize_name(software_name), max_results)
+        level = priority.get()
+        if level == BACKGROUND and _lookup_flight.running((*key, INTERACTIVE)):
+            level = INTERACTIVE
+        return await _lookup_flight.do((*key, level), lookup)
+
+    async def _wait_for_peer(self, software_name: str) -> Optional[Dict]:
+        """Another worker process is looking software_name up: its fresh result,
+        or None when it ended without caching one"""
+        info("Waiting for another worker's lookup of '%s'", software_name)
+        while await self._run_cache(self.cache.claimed, software_name):
+            await asyncio.sleep(PEER_POLL_INTERVAL)
+        cached = await self._run_cache(self.cache.get, software_name)
+        if cached is not None and cached[2] == FRESH:
+            cache_result("peer", True)
+            return cached[0]
+        return None
+
+    async def refresh(self, software_name: str, max_results: int = 5) -> None:
+        """Look software_name up again and update the cache, used by the prefetch scheduler"""
+        await self._lookup_shared(software_name, max_results)
+
+    def _schedule_refresh(self, software_name: str, max_results: int) -> None:
+        key = normalize_name(software_name)
+        if key in _refreshing:
+            return
+        if len(_refreshing) >= self.config["max_pending_refreshes"]:
+            # Served stale meanwhile, the next request for it tries again
+            debug("Not refreshing '%s', %d refreshes pending", key, len(_refreshing))
+            return
+        _refreshing.add(key)
+
+        async def refresh():
+            priority.set(BACKGROUND)
+            try:
+                await self._lookup_shared(software_name, max_results)
+            finally:
+                _refreshing.discard(key)
+
+        info("Refreshing stale cache entry for '%s'", key)
+        task = asyncio.create_task(refresh())
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
 
-            # Step 2: Safety check (temporarily disabled)
-            safe_urls = urls  # Bypassing safety check for now
-            
-            # Step 3: Content extraction
-            contents: List[str] = []
-            valid_urls: List[str] = []
-            for url in safe_urls:
-                content = self.extractor.get_content(url)
-                if content and content.get("content"):
-                    contents.append(content["content"])
-                    valid_urls.append(url)
-            
-            response_template["sources"] = valid_urls
-            response_template["metadata"]["urls_analyzed"] = len(valid_urls)
-            
-            if not contents:
-                response_template["error"] = "No extractable content found"
+    def _from_cache(self, software_name: str, result: Dict, age: float, read: float) -> Dict:
+        """Cached result with the timings of this request, which only read the cache"""
+        result = copy.deepcopy(result)
+        result["name"] = software_name
+        read_ms = round(read * 1000, 1)
+        result["metadata"]["timings"] = {"cache": read_ms, "total": read_ms}
+        return self._with_cache_metadata(result, True, age)
+
+    @staticmethod
+    def _with_cache_metadata(result: Dict, cached: bool, age: float) -> Dict:
+        result["metadata"]["cached"] = cached
+        result["metadata"]["cache_age"] = int(age)
+        return result
+
+    async def _lookup_timed(self, software_name: str, max_results: int) -> Dict:
+        # Runs as its own task, so the timings belong to this lookup only
+        timings = start_lookup_timings()
+        started = time.perf_counter()
+        result = await self._lookup_async(software_name, max_results)
+        self._add_timings(result, timings, time.perf_counter() - started)
+        return result
+
+    async def _lookup_async(self, software_name: str, max_results: int = 5):
+        """Search, safety check, fetch and analysis of one name, with blocking
+        calls moved off the event loop"""
+        response_template = self._new_response(software_name)
+
+        async with self._lookup_slot():
+            try:
+                # Step 0: Registries answer for names with an ecosystem hint or mapping
+                if self.sources is not None:
+                    with timed("source"):
+                        structured = await self._run_blocking(self.sources.lookup, software_name)
+                    if structured is not None:
+                        return self._from_source(response_template, *structured)
+                    software_name = self.sources.search_name(software_name)
+
+                # Step 1: Search for URLs
+                info("Searching for URLs...")
+                with timed("search"):
+                    urls = await self._run_blocking(
+                        self.search.search_urls,
+                        f"{software_name} latest version",
+                        max_results
+                    )
+                response_template["metadata"]["urls_searched"] = len(urls)
+
+                if not urls:
+                    response_template["error"] = "No search results found"
+                    return response_template
+
+                # Step 2: Safety check, unsafe pages are never fetched
+                with timed("safety"):
+                    safe_urls = await self.safety.filter_safe_async(urls)
+                if not self._check_safe(response_template, urls, safe_urls):
+                    return response_template
+
+                # Step 3: Content extraction, pages of one name are fetched in parallel
+                fetch_limit = asyncio.Semaphore(self.config["max_fetches_per_lookup"])
+
+                async def fetch(url: str) -> Dict:
+                    async with fetch_limit:
+                        return await self._run_blocking(self.extractor.get_content, url)
+
+                with timed("fetch"):
+                    pages = await asyncio.gather(*(fetch(url) for url in safe_urls))
+                contents = self._collect_contents(response_template, safe_urls, pages)
+                if not contents:
+                    return response_template
+
+                # Step 4: Version analysis
+                analysis = await self._run_blocking(self.analyzer.analyze_detailed, software_name, contents)
+                return self._finish(response_template, *analysis)
+
+            except QuotaTimeout as e:
+                return self._quota_exhausted(response_template, e)
+            except Exception as e:
+                error("Version search failed: %s", str(e), exc_info=True)
+                response_template["error"] = f"System error: {str(e)}"
                 return response_template
 
-            # Step 4: Version analysis
-            version = self.analyzer.analyze(software_name, contents)
-            if version:
-                response_template["version"] = version
-                response_template["metadata"]["analysis_time"] = "2023-12-20T00:00:00Z"  # Add actual timestamp
-            else:
-                response_template["error"] = "Version detection failed"
+    @contextlib.asynccontextmanager
+    async def _lookup_slot(self):
+        """A slot of the lookup semaphore. Slots go first come first served,
+        and a background lookup may hold one while it waits for quota, so
+        background lookups are limited to max_background_lookups of them"""
+        async with contextlib.AsyncExitStack() as stack:
+            if priority.get() == BACKGROUND:
+                await stack.enter_async_context(_get_background_semaphore(self.config["max_background_lookups"]))
+            await stack.enter_async_context(_get_lookup_semaphore(self.config["max_concurrent_lookups"]))
+            yield
+
+    async def find_versions(self, software_names: List[str], max_results: int = 5) -> List[Dict]:
+        """Look up several names concurrently, results keep the order of software_names"""
+        return await asyncio.gather(
+            *(self.find_version_async(name, max_results) for name in software_names)
+        )
+
+    async def iter_versions(self, software_names: List[str], max_results: int = 5) -> AsyncIterator[Tuple[int, Dict]]:
+        """Look up several names concurrently, yielding (index, result) as each one finishes"""
+        async def indexed(index: int, name: str) -> Tuple[int, Dict]:
+            return index, await self.find_version_async(name, max_results)
+
+        tasks = [asyncio.ensure_future(indexed(i, name)) for i, name in enumerate(software_names)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _run_cache(func, *args):
+        """Result cache call (SQLite) off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_cache_executor(), functools.partial(func, *args))
+
+    async def _run_blocking(self, func, *args):
+        # Threads don't inherit context variables on their own
+        executor = _get_executor(
+            self.config["max_concurrent_lookups"] * self.config["max_fetches_per_lookup"]
+        )
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args))
+
+    @staticmethod
+    def _check_safe(response_template: Dict, urls: List[str], safe_urls: List[str]) -> bool:
+        response_template["metadata"]["urls_unsafe"] = len(urls) - len(safe_urls)
+        if not safe_urls:
+            response_template["error"] = "No safe search results found"
+            return False
+        return True
+
+    @staticmethod
+    def _collect_contents(response_template: Dict, urls: List[str], pages: List[Dict]) -> List[str]:
+        contents: List[str] = []
+        valid_urls: List[str] = []
+        for url, page in zip(urls, pages):
+            if page and page.get("content"):
+                # Mirrors serving the same text count as sources but are analyzed once
+                if page["content"] not in contents:
+                    contents.append(page["content"])
+                valid_urls.append(url)
+
+        response_template["sources"] = valid_urls
+        response_template["metadata"]["urls_analyzed"] = len(valid_urls)
+
+        if not contents:
+            response_template["error"] = "No extractable content found"
+        return contents
+
+    @staticmethod
+    def _add_timings(result: Dict, timings: Dict[str, float], total: float) -> None:
+        """Stage timings of the lookup in milliseconds. fetch is the wall time of
+        all page fetches, extraction the time spent cleaning them added up"""
+        observe("lookup", total, lookup=False)
+        result["metadata"]["timings"] = {
+            **{stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+            "total": round(total * 1000, 1)
+        }
 
-            return response_template
+    @staticmethod
+    def _quota_exhausted(response_template: Dict, e: QuotaTimeout) -> Dict:
+        """Upstream busy: reported with a retry hint and never cached"""
+        warning("Lookup of %s gave up: %s", response_template["name"], str(e))
+        response_template["error"] = f"Upstream {e.api} busy, retry later"
+        response_template["metadata"]["retry_after"] = max(1, round(e.retry_after))
+        return response_template
 
-        except Exception as e:
-            error("Version search failed: %s", str(e), exc_info=True)
-            response_template["error"] = f"System error: {str(e)}"
-            return response_template
+    @classmethod
+    def _from_source(cls, response_template: Dict, source: str, found: Found) -> Dict:
+        """Version straight from a structured source, nothing searched or fetched"""
+        response_template["sources"] = found.sources
+        return cls._finish(response_template, found.version, source, 1.0)
 
+    @staticmethod
+    def _finish(response_template: Dict, version: Optional[str],
+                resolver: Optional[str] = None, confidence: float = 0.0) -> Dict:
+        response_template["metadata"]["resolver"] = resolver
+        response_template["metadata"]["resolver_confidence"] = confidence
+        if version:
+            response_template["version"] = version
+            response_template["metadata"]["analysis_time"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        else:
+            response_template["error"] = "Version detection failed"
+        return response_template
@@ -1,16 +1,144 @@
 from __future__ import annotations
 
 import re
-from typing import List
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
 from logging import info, warning, debug
 import json
-import requests
+
+from .env import env_int, env_str
+from .http_client import get_http_client
+from .gpt_batcher import get_gpt_batcher
+from .version_resolver import VersionResolver
+from .quota import QuotaTimeout
+from .metrics import PAGES_SCANNED, timed
+from .logs import Payload
+
+_SOFTWARE_WORD = re.compile(r'\b[A-Za-z]\w+\b', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+_WORD = re.compile(r'\b\w+\b')
+_JSON_OBJECT = re.compile(r'\{.*\}', re.DOTALL)
+_NAME_PART = re.compile(r'[\w+#]+')
+# Joins the windows of a page, nothing can match across it
+_WINDOW_GAP = "\x00"
+
+GPT_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+
+BATCH_REPLY_TOKENS_BASE = 50
+BATCH_REPLY_TOKENS_PER_ITEM = 30
+
+
+class _Extraction(NamedTuple):
+    candidates: List[Pattern]
+    any_version: Pattern
+
+
+@lru_cache(maxsize=8)
+def _compile_extraction(version_patterns: Tuple[str, ...]) -> _Extraction:
+    """Candidate patterns built from version_patterns, compiled once per process"""
+    software_pattern = r'[A-Za-z][\w\.\+\-\#]+ [A-Za-z][\w\.\+\-\#]+'
+
+    version_keywords = [
+        r'latest', r'version', r'release', r'stable', r'updated', r'current',
+        r'lts', r'beta', r'alpha', r'rc\d*', r'build', r'update'
+    ]
+
+    version_pattern = '|'.join(version_patterns)
+    keyword_pattern = '|'.join(version_keywords)
+
+    context_words = r'(?:версии|version|ver\.|v\.|release|rel\.|for|of|на|with)'
+
+    patterns = [
+        rf'(?<!\w)({software_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({version_pattern})(?!\w)',
+        rf'(?<!\w)({version_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({software_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+{context_words}\s+({version_pattern})(?!\w)',
+        rf'(?<!\w)({version_pattern})\s+{context_words}\s+({software_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+({keyword_pattern})\s+({version_pattern})(?!\w)',
+        rf'(?<!\w)({software_pattern})\s+({version_pattern})(?!\w)',
+    ]
+
+    return _Extraction(
+        [re.compile(pattern, re.IGNORECASE) for pattern in patterns],
+        re.compile('|'.join(version_patterns), re.IGNORECASE)
+    )
+
+
+@lru_cache(maxsize=1024)
+def _name_anchor(name: str) -> Optional[Pattern]:
+    """One pattern for the spellings of name: its characters in order, where
+    words may be joined by spaces, dots, dashes or underscores and one such
+    separator may split a word ("Node.js", "nodejs", "node js", "Node-JS")"""
+    parts = _NAME_PART.findall(name.lower())
+    if not parts:
+        return None
+    body = r'[\s._\-]*'.join(r'[\s._\-]?'.join(re.escape(char) for char in part) for part in parts)
+    return re.compile(rf'(?<!\w){body}(?!\w)', re.IGNORECASE)
+
+
+def _windows(anchor: Pattern, data: str, size: int) -> List[str]:
+    """Text within size characters of each mention found by anchor, in page
+    order, overlapping windows merged and cut at spaces so no word is split"""
+    spans: List[List[int]] = []  # start, end, first mention start, last mention end
+    for match in anchor.finditer(data):
+        start, end = max(0, match.start() - size), min(len(data), match.end() + size)
+        if spans and start <= spans[-1][1]:
+            spans[-1][1], spans[-1][3] = end, match.end()
+        else:
+            spans.append([start, end, match.start(), match.end()])
+
+    windows = []
+    for start, end, first, last in spans:
+        if start > 0:
+            space = data.find(" ", start, first)
+            start = space + 1 if space != -1 else first
+        if end < len(data):
+            space = data.rfind(" ", last, end)
+            end = space if space != -1 else last
+        windows.append(data[start:end])
+    return windows
+
+
+def _drop_contained(matches: List[str]) -> List[str]:
+    """Unique matches in first-seen order, without those whose text and words
+    are fully contained in a longer match"""
+    distinct: Dict[str, Set[str]] = {}
+    for match in matches:
+        if match not in distinct:
+            distinct[match] = set(_WORD.findall(match))
+
+    # word -> matches containing it, a container must share every word
+    index: Dict[str, List[str]] = {}
+    for match, words in distinct.items():
+        for word in words:
+            index.setdefault(word, []).append(match)
+
+    unique_matches = []
+    for match, words in distinct.items():
+        if words:
+            candidates = min((index[word] for word in words), key=len)
+        else:
+            candidates = distinct
+
+        contained = any(
+            other != match and match in other and words.issubset(distinct[other])
+            for other in candidates
+        )
+        if not contained:
+            unique_matches.append(match)
+
+    return unique_matches
+
 
 class ContentAnalyzer:
     def __init__(self, folder_id: str, gpt_api_key: str):
         self.folder_id = folder_id
         self.gpt_api_key = gpt_api_key
-        self.api_url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+        self.http = get_http_client().client("gpt")
+        self.batcher = get_gpt_batcher()
+        self.resolver = VersionResolver()
+        self.api_url = env_str("SWUC_GPT_URL", GPT_URL)
+        # Characters around each mention of the name that are searched, 0 searches whole pages
+        self.window = env_int("SWUC_SCAN_WINDOW", 300)
         self.headers={
             "Accept": "application/json",
             "Authorization": f"Bearer {gpt_api_key}"
@@ -60,130 +188,192 @@ class ContentAnalyzer:
 #        
 #        return results
 
-    def _extract_possible(self, data: str):
+    def warmup(self) -> None:
+        """Compile the extraction patterns before the first page needs them"""
+        _compile_extraction(tuple(self.version_patterns))
+
+    def _extract_possible(self, data: str, name: Optional[str] = None):
+        """Version candidates of a page. With name, only the text around its
+        mentions is searched, and a page not mentioning it has none"""
         info("Extracting possible versions")
 
-        software_pattern = r'[A-Za-z][\w\.\+\-\#]+ [A-Za-z][\w\.\+\-\#]+'
-        
-        version_keywords = [
-            r'latest', r'version', r'release', r'stable', r'updated', r'current',
-            r'lts', r'beta', r'alpha', r'rc\d*', r'build', r'update'
-        ]
-        
-        version_pattern = '|'.join(self.version_patterns)
-        keyword_pattern = '|'.join(version_keywords)
-        
-        context_words = r'(?:версии|version|ver\.|v\.|release|rel\.|for|of|на|with)'
-        
-        patterns = [
-            rf'(?<!\w)({software_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({version_pattern})(?!\w)',
-            rf'(?<!\w)({version_pattern})\s+(?:{keyword_pattern}\s+)?(?:{context_words}\s+)?({software_pattern})(?!\w)',
-            rf'(?<!\w)({software_pattern})\s+{context_words}\s+({version_pattern})(?!\w)',
-            rf'(?<!\w)({version_pattern})\s+{context_words}\s+({software_pattern})(?!\w)',
-            rf'(?<!\w)({software_pattern})\s+({keyword_pattern})\s+({version_pattern})(?!\w)',
-            rf'(?<!\w)({software_pattern})\s+({keyword_pattern})\s+({version_pattern})(?!\w)',
-            rf'(?<!\w)({software_pattern})\s+({version_pattern})(?!\w)',
-        ]
-        
+        compiled = _compile_extraction(tuple(self.version_patterns))
+
+        anchor = _name_anchor(name) if name and self.window > 0 else None
+        if anchor is not None:
+            windows = _windows(anchor, data, self.window)
+            PAGES_SCANNED.inc(scan="windows" if windows else "no_mention")
+            if not windows:
+                debug("No mention of '%s' on the page, skipped", name)
+                return []
+            data = _WINDOW_GAP.join(windows)
+        else:
+            PAGES_SCANNED.inc(scan="full")
+
         all_matches = []
-        for pattern in patterns:
-            matches = re.finditer(pattern, data, re.IGNORECASE)
-            for match in matches:
+        for pattern in compiled.candidates:
+            for match in pattern.finditer(data):
                 full_match = match.group(0).strip()
-                
-                has_version = any(re.search(vp, full_match, re.IGNORECASE) for vp in self.version_patterns)
-                potential_software = re.search(r'\b[A-Za-z]\w+\b', full_match, re.IGNORECASE)
-                
+
+                has_version = compiled.any_version.search(full_match)
+                potential_software = _SOFTWARE_WORD.search(full_match)
+
                 if has_version and potential_software:
-                    normalized_match = re.sub(r'\s+', ' ', full_match)
+                    normalized_match = _WHITESPACE.sub(' ', full_match)
                     all_matches.append(normalized_match)
-        
-        unique_matches = []
-        for match in all_matches:
-            is_substring = False
-            for other in all_matches:
-                if match != other and match in other:
-                    match_words = set(re.findall(r'\b\w+\b', match))
-                    other_words = set(re.findall(r'\b\w+\b', other))
-                    if match_words.issubset(other_words) and len(match) < len(other):
-                        is_substring = True
-                        break
-            
-            if not is_substring and match not in unique_matches:
-                unique_matches.append(match)
+
+        unique_matches = _drop_contained(all_matches)
 
         info("Extracted: %s", str(unique_matches))
-        
+
         return unique_matches
 
+    def _complete(self, system: str, user: str, max_tokens: int) -> str:
+        """One YandexGPT completion, returns the text of the first alternative"""
+        prompt = {
+            "modelUri": f"gpt://{self.folder_id}/yandexgpt-lite",
+            "completionOptions": {
+                "temperature": 0,
+                "maxTokens": max_tokens
+            },
+            "messages": [
+                {
+                    "role": "system",
+                    "text": system
+                },
+                {
+                    "role": "user",
+                    "text": user
+                }
+            ]
+        }
+
+        response = self.http.post(
+            self.api_url,
+            headers=self.headers,
+            json=prompt
+        )
+        response.raise_for_status()
+
+        result = response.json()
+        return result['result']['alternatives'][0]['message']['text']
+
+    def _parse_version(self, gpt_response: str):
+        # Enhanced post-GPT validation with multiple patterns
+        best_match = None
+        for pattern in self.version_patterns:
+            match = re.search(pattern, gpt_response, re.IGNORECASE)
+            if match:
+                best_match = match.group(0).lstrip('v').strip()
+                info("Pattern %s matched: %s", pattern, best_match)
+                break
+
+        if best_match:
+            # Clean up version format
+            clean_version = re.sub(r'\s+', '', best_match)  # Remove any whitespace
+            info("Validated version after GPT: %s", clean_version)
+            return clean_version
+
+        return None
+
     def _select_by_gpt(self, name: str, extracted: str):
         info("Extracting version using GPT")
         try:
-            prompt = {
-                "modelUri": f"gpt://{self.folder_id}/yandexgpt-lite",
-                "completionOptions": {
-                    "temperature": 0,
-                    "maxTokens": 300
-                },
-                "messages": [
-                    {
-                        "role": "system",
-                        "text": (
-                            f"Определи последнюю версию {name}.\n"
-                            "Правила:\n1. Только числовые версии\n"
-                            "2. Формат: X.Y.Z"
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "text": extracted
-                    }
-                ]
-            }
-            
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=prompt,
-                timeout=15
+            gpt_response = self._complete(
+                (
+                    f"Определи последнюю версию {name}.\n"
+                    "Правила:\n1. Только числовые версии\n"
+                    "2. Формат: X.Y.Z"
+                ),
+                extracted,
+                300
             )
-            response.raise_for_status()
-            
-            result = response.json()
-            gpt_response = result['result']['alternatives'][0]['message']['text']
-            info("GPT Raw Response: %s", gpt_response)
-
-            # Enhanced post-GPT validation with multiple patterns
-            best_match = None
-            for pattern in self.version_patterns:
-                match = re.search(pattern, gpt_response, re.IGNORECASE)
-                if match:
-                    best_match = match.group(0).lstrip('v').strip()
-                    info("Pattern %s matched: %s", pattern, best_match)
-                    break
-
-            if best_match:
-                # Clean up version format
-                clean_version = re.sub(r'\s+', '', best_match)  # Remove any whitespace
-                info("Validated version after GPT: %s", clean_version)
-                return clean_version
-
-            warning("No valid version found in GPT response")
-            return None
+            info("GPT Raw Response: %s", Payload(gpt_response))
+
+            version = self._parse_version(gpt_response)
+            if version is None:
+                warning("No valid version found in GPT response")
+            return version
 
+        except QuotaTimeout:
+            raise
         except Exception as e:
             warning("GPT analysis failed: %s", str(e))
             return None
 
+    def _select_batch_by_gpt(self, items: List[Tuple[str, str]]) -> Optional[List[Optional[str]]]:
+        """Versions for several (name, candidates) pairs from one completion,
+        None when the reply can't be parsed"""
+        info("Extracting versions of %d programs using one GPT call", len(items))
+        blocks = "\n\n".join(
+            f"### {index}: {name}\n{extracted}"
+            for index, (name, extracted) in enumerate(items, 1)
+        )
+        try:
+            gpt_response = self._complete(
+                (
+                    "Для каждой программы ниже определи её последнюю версию по строкам-кандидатам.\n"
+                    "Правила:\n1. Только числовые версии\n"
+                    "2. Формат: X.Y.Z\n"
+                    "3. Ответ — только JSON-объект вида "
+                    '{"1": "X.Y.Z", "2": null}, где ключ — номер программы, '
+                    "null — если версию определить нельзя"
+                ),
+                blocks,
+                BATCH_REPLY_TOKENS_BASE + BATCH_REPLY_TOKENS_PER_ITEM * len(items)
+            )
+            info("GPT Raw Batch Response: %s", Payload(gpt_response))
+        except QuotaTimeout:
+            raise
+        except Exception as e:
+            warning("Batched GPT analysis failed: %s", str(e))
+            return None
+
+        reply = _JSON_OBJECT.search(gpt_response)
+        try:
+            answers = json.loads(reply.group(0)) if reply else None
+        except json.JSONDecodeError:
+            answers = None
+        if not isinstance(answers, dict):
+            warning("Unparseable batched GPT response")
+            return None
+
+        versions = []
+        for index in range(1, len(items) + 1):
+            if str(index) not in answers:
+                warning("Batched GPT response misses program %d", index)
+                return None
+            answer = answers[str(index)]
+            # A bare JSON number has lost its digits already: 3.10 reads as 3.1
+            if answer is not None and not isinstance(answer, str):
+                warning("Batched GPT response has a non-string version for program %d", index)
+                return None
+            versions.append(self._parse_version(answer) if answer else None)
+        return versions
+
+    def _select(self, name: str, extracted: str):
+        if self.batcher is None:
+            return self._select_by_gpt(name, extracted)
+        return self.batcher.submit(self, name, extracted)
 
     def analyze(self, name: str, contents: List[str]):
-        extracted_data = []
-        for data in contents:
-            extracted_data += self._extract_possible(data)
+        return self.analyze_detailed(name, contents)[0]
+
+    def analyze_detailed(self, name: str, contents: List[str]) -> Tuple[Optional[str], Optional[str], float]:
+        """(version, resolver that decided it, resolver confidence), the LLM is
+        asked only when the local consensus is not confident enough"""
+        with timed("candidates"):
+            candidates_per_page = [self._extract_possible(data, name) for data in contents]
+        extracted_data = [candidate for page in candidates_per_page for candidate in page]
 
         if not extracted_data:
             info("No version candidates found in input")
-            return None
+            return None, None, 0.0
+
+        with timed("resolver"):
+            version, confidence = self.resolver.decide(name, candidates_per_page)
+        if version is not None:
+            return version, "consensus", confidence
 
         # Prioritize matches with more components
         unique_matches = sorted(
@@ -193,6 +383,7 @@ class ContentAnalyzer:
         )[:20]  # Take top 15 most specific candidates
         
         extracted_str = "\n".join(unique_matches)
-        info("Sending to GPT: %s", extracted_str)
+        debug("Sending to GPT: %s", Payload(extracted_str))
 
-        return self._select_by_gpt(name, extracted_str)
+        with timed("gpt"):
+            return self._select(name, extracted_str), "gpt", confidence
@@ -1,42 +1,264 @@
 # content_extractor.py
-import requests
+import codecs
 import re
-from typing import Dict
+import time
+from typing import Dict, List, Tuple
 from logging import debug, info, warning
 
+from .env import env_int
+from .http_client import get_http_client
+from .page_cache import get_page_cache
+from .metrics import cache_result, observe, timed
+from .logs import Payload
+from .singleflight import SingleFlight
+
+_SCRIPT_STYLE = re.compile(r'<(script|style)[^>]*>.*?</\1>', flags=re.DOTALL)
+_TAG = re.compile(r'<[^>]+>')
+_BLOCK_START = re.compile(r'<(script|style)')
+_WHITESPACE = re.compile(r'\s+')
+
+TEXT_CONTENT_TYPES = ("text/", "application/xhtml+xml", "application/xml")
+
+_fetch_flight = SingleFlight("fetch")
+
+
+def _strip_tags(html: str) -> str:
+    # Remove script/style tags
+    cleaned = _SCRIPT_STYLE.sub('', html)
+    # Remove HTML tags
+    return _TAG.sub(' ', cleaned)
+
+
+class _TextCollector:
+    """Incremental form of the clean_content regexes: drops script/style blocks,
+    then tags, collapses whitespace and stops once more than limit characters
+    of text are collected"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.length = 0
+        self._parts: List[str] = []
+        self._space = False
+        # Input not yet passed through the script/style stage. While a block
+        # waits for more input: where its '>' is and where to continue looking
+        self._raw = ""
+        self._block_gt = -1
+        self._block_scan = 0
+        # Output of the script/style stage not yet passed through the tag stage
+        self._pending = ""
+
+    @property
+    def full(self) -> bool:
+        return self.length > self.limit
+
+    def feed(self, html: str, final: bool = False) -> bool:
+        """Process the next piece of the document, returns True when no more input is needed"""
+        self._strip_tags(self._strip_blocks(html, final), final)
+        return self.full
+
+    def close(self) -> str:
+        if (self._raw or self._pending) and not self.full:
+            self.feed("", final=True)
+        return "".join(self._parts)
+
+    def _strip_blocks(self, html: str, final: bool) -> str:
+        """Same as _SCRIPT_STYLE.sub('', ...), holding back blocks until their end is seen"""
+        buf = self._raw + html
+        n = len(buf)
+        out = []
+        i = 0
+        while True:
+            block = _BLOCK_START.search(buf, i)
+            if block is None:
+                # A block start may be cut at the end of this piece
+                safe = n if final else max(i, n - len("<script") + 1)
+                out.append(buf[i:safe])
+                i = safe
+                break
+            out.append(buf[i:block.start()])
+            i = block.start()
+
+            gt = self._block_gt
+            if gt == -1:
+                gt = buf.find('>', max(block.end(), self._block_scan))
+            closer = f"</{block.group(1)}>"
+            end = buf.find(closer, max(gt + 1, self._block_scan)) if gt != -1 else -1
+            if end == -1:
+                if final:
+                    # No match at this position, the regex moves on by one character
+                    out.append('<')
+                    i += 1
+                    self._block_gt, self._block_scan = -1, 0
+                    continue
+                self._block_gt = gt
+                self._block_scan = n - len(closer) + 1 if gt != -1 else n
+                break
+
+            i = end + len(closer)
+            self._block_gt, self._block_scan = -1, 0
+
+        self._raw = buf[i:]
+        if self._block_gt != -1:
+            self._block_gt -= i
+        self._block_scan = max(0, self._block_scan - i)
+        return "".join(out)
+
+    def _strip_tags(self, text: str, final: bool) -> None:
+        """Same as _TAG.sub(' ', ...) followed by whitespace collapsing"""
+        buf = self._pending + text
+        n = len(buf)
+        i = 0
+        while i < n and not self.full:
+            start = buf.find('<', i)
+            if start == -1:
+                self._emit(buf[i:])
+                i = n
+                break
+            self._emit(buf[i:start])
+            i = start
+
+            close = buf.find('>', i + 1)
+            if close == -1:
+                if final:
+                    self._emit(buf[i:])  # '<' without '>' is plain text
+                    i = n
+                break
+            if close == i + 1:
+                self._emit('<')  # '<>' is not a tag
+                i += 1
+                continue
+
+            self._emit(' ')
+            i = close + 1
+        self._pending = buf[i:]
+
+    def _emit(self, text: str) -> None:
+        if not text:
+            return
+        for index, part in enumerate(_WHITESPACE.split(text)):
+            if index:
+                self._space = True
+            if part:
+                if self._space and self.length:
+                    self._parts.append(' ')
+                    self.length += 1
+                self._space = False
+                self._parts.append(part)
+                self.length += len(part)
+
+
 class ContentExtractor:
     def __init__(self, max_chars: int = 5000):
         self.max_chars = max_chars
+        self.http = get_http_client().client("extractor")
+        self.max_bytes = env_int("SWUC_FETCH_MAX_BYTES", 2 * 1024 * 1024)
+        self.chunk_size = env_int("SWUC_FETCH_CHUNK_BYTES", 16384)
+        self.cache = get_page_cache()
         info("ContentExtractor initialized with max %d characters", max_chars)
 
     def get_content(self, url: str) -> Dict:
-        """Smart content extraction with cleanup"""
+        """Smart content extraction with cleanup, identical concurrent fetches run once"""
+        with timed("page_fetch", lookup=False):
+            return _fetch_flight.do(url, self._fetch, url)
+
+    def _fetch(self, url: str) -> Dict:
+        """Reads only as much of the page as needed, revalidating cached pages
+        with a conditional GET instead of downloading them again"""
+        cached = self.cache.get(url) if self.cache else None
+        if cached is not None and self.cache.is_fresh(cached):
+            debug("Page cache hit for %s", url)
+            cache_result("page", True)
+            self.cache.record_hit(url, cached, revalidated=False)
+            return {"content": cached.content, "url": url}
+
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
         info("Fetching content from: %s", url)
         try:
-            response = requests.get(
+            with self.http.get(
                 url,
-                headers={"User-Agent": "Mozilla/5.0"},
-                timeout=15
-            )
-            debug("Response status %d for %s", response.status_code, url)
-            return self.clean_content(response.text, url)
+                headers=headers,
+                stream=True
+            ) as response:
+                debug("Response status %d for %s", response.status_code, url)
+
+                if response.status_code == 304 and cached is not None:
+                    debug("Page %s not modified", url)
+                    cache_result("page", True)
+                    self.cache.record_hit(url, cached, revalidated=True)
+                    return {"content": cached.content, "url": url}
+
+                content_type = response.headers.get("Content-Type", "").lower()
+                if content_type and not content_type.startswith(TEXT_CONTENT_TYPES):
+                    info("Skipping %s with content type %s", url, content_type)
+                    return {"content": "", "url": url}
+
+                cleaned, received = self._read(response, url)
+                page = self._truncate(cleaned, url)
+                if self.cache:
+                    cache_result("page", False)
+                    self.cache.record_miss()
+                    if response.status_code == 200 and page["content"]:
+                        self.cache.put(
+                            url, page["content"],
+                            response.headers.get("ETag"),
+                            response.headers.get("Last-Modified"),
+                            received
+                        )
+                return page
         except Exception as e:
             warning("Failed to fetch content from %s: %s", url, str(e))
             return {"content": "", "url": url}
 
+    def _read(self, response, url: str) -> Tuple[str, int]:
+        """(cleaned text, bytes received) of a streamed response"""
+        try:
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        collector = _TextCollector(self.max_chars)
+        received = 0
+        # Time spent cleaning, without the time spent waiting for the network
+        cleaning = 0.0
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            received += len(chunk)
+            started = time.perf_counter()
+            enough = collector.feed(decoder.decode(chunk))
+            cleaning += time.perf_counter() - started
+            if enough:
+                debug("Collected enough text from %s after %d bytes", url, received)
+                break
+            if received >= self.max_bytes:
+                warning("Stopped reading %s at %d bytes", url, received)
+                break
+        else:
+            started = time.perf_counter()
+            collector.feed(decoder.decode(b"", final=True), final=True)
+            cleaning += time.perf_counter() - started
+
+        started = time.perf_counter()
+        cleaned = collector.close()
+        observe("extraction", cleaning + time.perf_counter() - started)
+        debug("Read %d bytes, cleaned length: %d", received, len(cleaned))
+        return cleaned, received
+
     def clean_content(self, html: str, url: str) -> Dict:
         """Clean and extract main content"""
         debug("Cleaning content from %s", url)
-        # Remove script/style tags
-        cleaned = re.sub(r'<(script|style)[^>]*>.*?</\1>', '', html, flags=re.DOTALL)
-        # Remove HTML tags
-        cleaned = re.sub(r'<[^>]+>', ' ', cleaned)
         # Collapse whitespace
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        
-        debug("Original length: %d, Cleaned length: %d", 
+        cleaned = _WHITESPACE.sub(' ', _strip_tags(html)).strip()
+
+        debug("Original length: %d, Cleaned length: %d",
                     len(html), len(cleaned))
+        return self._truncate(cleaned, url)
 
+    def _truncate(self, cleaned: str, url: str) -> Dict:
         if len(cleaned) > self.max_chars:
             cutoff = cleaned.rfind('.', self.max_chars//2, self.max_chars)
             if cutoff != -1:
@@ -45,7 +267,7 @@ class ContentExtractor:
             else:
                 debug("Truncated to max %d characters", self.max_chars)
                 cleaned = cleaned[:self.max_chars]
-        
+
         info("Final content length for %s: %d characters", url, len(cleaned))
-        info("Content: %s", cleaned)
+        debug("Content: %s", Payload(cleaned))
         return {"content": cleaned, "url": url}
@@ -0,0 +1,44 @@
+import os
+from logging import warning
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        warning(f"Incorrect {name} value: '{value}', using default {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        warning(f"Incorrect {name} value: '{value}', using default {default}")
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_str(name: str, default: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value
+
+
+def worker_count() -> int:
+    """Server processes sharing the machine (SWUC_WORKERS), per-process limits
+    that stand for a machine-wide budget are divided by it"""
+    return max(1, env_int("SWUC_WORKERS", 1))
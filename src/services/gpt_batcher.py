@@ -0,0 +1,174 @@
+# gpt_batcher.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import debug, info, warning
+from typing import List, Optional
+
+from .env import env_int
+from .quota import QuotaTimeout, priority
+
+# Rough size of a prompt in tokens, YandexGPT averages 3-4 characters per token
+CHARS_PER_TOKEN = 3
+
+
+class _Pending:
+    __slots__ = ("analyzer", "name", "extracted", "tokens", "queued_at", "priority", "done", "result", "error")
+
+    def __init__(self, analyzer, name: str, extracted: str):
+        self.analyzer = analyzer
+        self.name = name
+        self.extracted = extracted
+        self.tokens = (len(name) + len(extracted)) // CHARS_PER_TOKEN + 10
+        self.queued_at = time.monotonic()
+        self.priority = priority.get()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GptBatcher:
+    """Collects version questions of concurrent lookups for a short window and
+    asks them in one completion, falling back to one call per name when the
+    batched reply can't be parsed"""
+
+    def __init__(self, batch_size: int, token_budget: int, window: float, workers: int):
+        self.batch_size = batch_size
+        self.token_budget = token_budget
+        self.window = window
+        self._queue: List[_Pending] = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="swuc-gpt")
+        self._thread = threading.Thread(target=self._run, name="swuc-gpt-batcher", daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+        info("GptBatcher: up to %d names / %d tokens per call, %.0f ms window",
+             batch_size, token_budget, window * 1000)
+
+    def submit(self, analyzer, name: str, extracted: str) -> Optional[str]:
+        """Blocks the calling worker thread until the version for name is known"""
+        pending = _Pending(analyzer, name, extracted)
+        with self._cond:
+            self._queue.append(pending)
+            self._cond.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _full(self) -> bool:
+        return (len(self._queue) >= self.batch_size
+                or sum(p.tokens for p in self._queue) >= self.token_budget)
+
+    def _take_batch(self) -> List[_Pending]:
+        batch = []
+        tokens = 0
+        while self._queue and len(batch) < self.batch_size:
+            pending = self._queue[0]
+            if batch and tokens + pending.tokens > self.token_budget:
+                break
+            batch.append(self._queue.pop(0))
+            tokens += pending.tokens
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = self._queue[0].queued_at + self.window
+                while not self._full():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._executor.submit(self._answer, batch)
+
+    def _answer(self, batch: List[_Pending]) -> None:
+        if len(batch) == 1:
+            self._answer_one(batch[0])
+            return
+
+        # A batch is as urgent as its most urgent name
+        token = priority.set(min(p.priority for p in batch))
+        try:
+            debug("Sending batch of %d names to GPT", len(batch))
+            versions = batch[0].analyzer._select_batch_by_gpt(
+                [(p.name, p.extracted) for p in batch]
+            )
+        except QuotaTimeout as e:
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            warning("GPT batch failed: %s", str(e))
+            self._fail(batch, None)
+            return
+        finally:
+            priority.reset(token)
+
+        if versions is not None:
+            self.batches += 1
+            self.batched_items += len(batch)
+            for pending, version in zip(batch, versions):
+                pending.result = version
+                pending.done.set()
+            return
+
+        # Asked side by side, the batch takes as long as its slowest name
+        warning("Falling back to one GPT call per name for %d names", len(batch))
+        self.fallbacks += 1
+        for pending in batch:
+            self._executor.submit(self._answer_one, pending)
+
+    @staticmethod
+    def _answer_one(pending: _Pending) -> None:
+        token = priority.set(pending.priority)
+        try:
+            pending.result = pending.analyzer._select_by_gpt(pending.name, pending.extracted)
+        except QuotaTimeout as e:
+            pending.error = e
+        except Exception as e:
+            warning("GPT call failed: %s", str(e))
+        finally:
+            priority.reset(token)
+            pending.done.set()
+
+    @staticmethod
+    def _fail(batch: List[_Pending], error: Optional[Exception]) -> None:
+        for pending in batch:
+            pending.error = error
+            pending.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "fallbacks": self.fallbacks,
+            "queued": queued
+        }
+
+
+_gpt_batcher: Optional[GptBatcher] = None
+_gpt_batcher_lock = threading.Lock()
+
+
+def get_gpt_batcher() -> Optional[GptBatcher]:
+    """Process-wide batcher, None when SWUC_GPT_BATCH_SIZE is 1 or less"""
+    global _gpt_batcher
+    batch_size = env_int("SWUC_GPT_BATCH_SIZE", 8)
+    if batch_size <= 1:
+        return None
+    with _gpt_batcher_lock:
+        if _gpt_batcher is None:
+            _gpt_batcher = GptBatcher(
+                batch_size,
+                env_int("SWUC_GPT_BATCH_TOKENS", 6000),
+                env_int("SWUC_GPT_BATCH_WINDOW_MS", 50) / 1000,
+                env_int("SWUC_GPT_BATCH_WORKERS", 4)
+            )
+        return _gpt_batcher
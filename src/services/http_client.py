@@ -0,0 +1,189 @@
+# http_client.py
+import threading
+import time
+from logging import info, warning
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .env import env_float, env_int
+from .quota import QuotaTimeout, get_quota, parse_retry_after
+from .metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS, UPSTREAM_TIMEOUTS
+
+# Defaults per service: (connect timeout, read timeout, retries, backoff factor)
+SERVICE_DEFAULTS = {
+    "search": (5.0, 10.0, 2, 0.5),
+    "safety": (5.0, 15.0, 2, 0.5),
+    "extractor": (5.0, 15.0, 0, 0.0),
+    "gpt": (5.0, 15.0, 1, 1.0),
+    "sources": (5.0, 10.0, 1, 0.5),
+}
+RETRIED_METHODS = frozenset({"GET", "HEAD", "POST"})
+RETRIED_STATUSES = (500, 502, 503, 504)
+
+
+class ServiceClient:
+    """Keep-alive HTTP session of one upstream service with its own timeouts and retries.
+
+    Requests to an API with a quota wait for a token of its bucket, and a 429
+    answer pauses the bucket for Retry-After and queues the request again,
+    until the caller's deadline passes. Their failed answers are retried
+    here too, each attempt with a token of its own; urllib3 only retries
+    connections that failed before the request was sent."""
+
+    def __init__(self, name: str, pool_hosts: int, pool_per_host: int):
+        connect, read, retries, backoff = SERVICE_DEFAULTS.get(name, (5.0, 15.0, 0, 0.0))
+        prefix = f"SWUC_HTTP_{name.upper()}"
+        self.name = name
+        self.quota = get_quota(name)
+        self.timeout = (
+            env_float(f"{prefix}_CONNECT_TIMEOUT", connect),
+            env_float(f"{prefix}_READ_TIMEOUT", read)
+        )
+        self.retries = env_int(f"{prefix}_RETRIES", retries)
+        self.backoff = env_float(f"{prefix}_BACKOFF", backoff)
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=() if self.quota else (429, *RETRIED_STATUSES),
+            # Throttling is left to the quota, which shares the pause with every caller
+            respect_retry_after_header=self.quota is None,
+            # GPT and Safe Browsing calls are POSTs without side effects; with a quota
+            # no method is retried here, only connects that never reached the API
+            allowed_methods=frozenset() if self.quota else RETRIED_METHODS,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_per_host,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        info("HTTP client '%s': timeout %s, %d retries", name, self.timeout, retry.total)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        if self.quota is None:
+            return self._send(method, url, **kwargs)
+
+        deadline = self.quota.deadline()
+        failures = 0
+        while True:
+            try:
+                self.quota.acquire(deadline)
+            except QuotaTimeout:
+                UPSTREAM_TIMEOUTS.inc(api=self.name, kind="quota")
+                raise
+            response = self._send(method, url, **kwargs)
+            if self._throttled(response):
+                self.quota.hold(parse_retry_after(response.headers.get("Retry-After")))
+            elif response.status_code in RETRIED_STATUSES and failures < self.retries:
+                failures += 1
+                time.sleep(min(self.backoff * 2 ** (failures - 1), max(0.0, deadline - time.monotonic())))
+            else:
+                return response
+            response.close()
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.Timeout:
+            UPSTREAM_TIMEOUTS.inc(api=self.name, kind="http")
+            raise
+        except requests.RequestException:
+            UPSTREAM_ERRORS.inc(api=self.name)
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, api=self.name)
+        if response.status_code >= 500:
+            UPSTREAM_ERRORS.inc(api=self.name)
+        return response
+
+    @staticmethod
+    def _throttled(response: requests.Response) -> bool:
+        return response.status_code == 429 or (
+            response.status_code == 503 and "Retry-After" in response.headers
+        )
+
+    def warm(self, url: str) -> bool:
+        """Open a pooled connection to url's host ahead of the first real request.
+        A bare HEAD, outside the quota and the metrics, whatever it answers"""
+        try:
+            self.session.head(url, timeout=self.timeout, allow_redirects=False).close()
+            return True
+        except requests.RequestException as e:
+            warning("Could not open a connection for '%s': %s", self.name, str(e))
+            return False
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict:
+        pools = self.adapter.poolmanager.pools
+        requests_sent = connections = idle = hosts = 0
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue  # Evicted meanwhile
+            hosts += 1
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            "requests": requests_sent,
+            "connections_opened": connections,
+            "reuse_rate": round(1 - connections / requests_sent, 3) if requests_sent else 0.0,
+            "hosts": hosts,
+            "idle_connections": idle
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class HttpClient:
+    """Shared HTTP layer for all upstream services, one pooled client per service"""
+
+    def __init__(self):
+        self.pool_hosts = env_int("SWUC_HTTP_POOL_HOSTS", 32)
+        self.pool_per_host = env_int("SWUC_HTTP_POOL_PER_HOST", 10)
+        self._clients: Dict[str, ServiceClient] = {}
+        self._lock = threading.Lock()
+
+    def client(self, service: str) -> ServiceClient:
+        with self._lock:
+            if service not in self._clients:
+                self._clients[service] = ServiceClient(service, self.pool_hosts, self.pool_per_host)
+            return self._clients[service]
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            clients = dict(self._clients)
+        return {name: client.stats() for name, client in clients.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+_http_client: Optional[HttpClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
@@ -0,0 +1,120 @@
+# logs.py
+import atexit
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+from .env import env_int, env_str
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class Payload:
+    """Log argument for message bodies and page texts, rendered only when the
+    record is actually written: short values as is, long ones cut to
+    SWUC_LOG_PAYLOAD_CHARS plus their size and hash, bytes never in full"""
+
+    __slots__ = ("value",)
+    limit = 200
+
+    def __init__(self, value: Union[str, bytes, object]):
+        self.value = value
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            return f"<{len(value)} bytes, sha256 {hashlib.sha256(value).hexdigest()[:12]}>"
+        text = value if isinstance(value, str) else str(value)
+        if len(text) <= self.limit:
+            return text
+        digest = hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:12]
+        return f"{text[:self.limit]}... <{len(text)} chars, sha256 {digest}>"
+
+
+class _SampleDebug(logging.Filter):
+    """Lets one in every `rate` DEBUG records of each call site through"""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._seen: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or self.rate <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._seen.get(site, 0)
+            self._seen[site] = seen + 1
+        return seen % self.rate == 0
+
+
+class _BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking when the writer thread falls behind"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_BoundedQueueHandler] = None
+
+
+def setup_logging(filename: str = "server.log", worker: Optional[int] = None) -> None:
+    """Send the root logger through a bounded queue to a thread writing a rotated file.
+    Worker processes write their own file, server.log becomes server.worker<N>.log"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    filename = env_str("SWUC_LOG_FILE", filename)
+    if worker is not None:
+        root, ext = os.path.splitext(filename)
+        filename = f"{root}.worker{worker}{ext}"
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename,
+        maxBytes=env_int("SWUC_LOG_MAX_BYTES", 50 * 1024 * 1024),
+        backupCount=env_int("SWUC_LOG_BACKUPS", 5),
+        encoding="utf-8"
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    _queue_handler = _BoundedQueueHandler(queue.Queue(env_int("SWUC_LOG_QUEUE", 10000)))
+    _queue_handler.addFilter(_SampleDebug(env_int("SWUC_LOG_DEBUG_SAMPLE", 10)))
+    Payload.limit = env_int("SWUC_LOG_PAYLOAD_CHARS", 200)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    level = logging.getLevelName(env_str("SWUC_LOG_LEVEL", "INFO").upper())
+    root.setLevel(level if isinstance(level, int) else logging.INFO)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out queued records, called at exit"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
@@ -0,0 +1,247 @@
+# metrics.py
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from logging import info, warning
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, Prometheus adds +Inf
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._format_labels(key)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (last one is +Inf), sum
+        self._series: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._series[key] = (counts, total + value)
+
+    def series(self) -> Dict[LabelValues, Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    def quantile(self, q: float, counts: List[int]) -> float:
+        """Estimate from bucket counts, interpolating linearly inside a bucket"""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, (counts, total) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = self._format_labels(key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_registry: List[_Metric] = []
+
+STAGE_SECONDS = Histogram(
+    "swuc_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+)
+UPSTREAM_SECONDS = Histogram(
+    "swuc_upstream_seconds", "Duration of upstream HTTP requests", ["api"]
+)
+CACHE_REQUESTS = Counter(
+    "swuc_cache_requests_total", "Cache lookups by cache and outcome", ["cache", "result"]
+)
+UPSTREAM_ERRORS = Counter(
+    "swuc_upstream_errors_total", "Failed upstream requests (exceptions and 5xx answers)", ["api"]
+)
+UPSTREAM_TIMEOUTS = Counter(
+    "swuc_upstream_timeouts_total", "Upstream requests that timed out or gave up waiting for quota", ["api", "kind"]
+)
+REQUESTS = Counter(
+    "swuc_requests_total", "Client requests by protocol and outcome", ["protocol", "outcome"]
+)
+SOURCE_LOOKUPS = Counter(
+    "swuc_source_lookups_total", "Structured source lookups by source and result", ["source", "result"]
+)
+PAGES_SCANNED = Counter(
+    "swuc_pages_scanned_total", "Pages searched for version candidates, by how much of them was searched", ["scan"]
+)
+STARTUP_SECONDS = Gauge(
+    "swuc_startup_seconds", "Seconds from process start to warmup done, ready and first response", ["milestone"]
+)
+
+# Stage timings of the lookup running in this context, in seconds. The dict
+# is shared with worker threads because _run_blocking copies the context
+_lookup_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "swuc_lookup_timings", default=None
+)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def start_lookup_timings() -> Dict[str, float]:
+    """Collect the stage timings of the lookup running in the current context"""
+    timings: Dict[str, float] = {}
+    _lookup_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def timed(stage: str, lookup: bool = True) -> Iterator[None]:
+    """Observe the duration of a stage, and add it to the current lookup's
+    timings unless lookup is False"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, lookup)
+
+
+def observe(stage: str, seconds: float, lookup: bool = True) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _lookup_timings.get() if lookup else None
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+async def _serve_metrics(ready: Optional[Callable[[], bool]],
+                         reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass  # Headers are not needed
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else None
+        if path == "/metrics":
+            status, body = "200 OK", render().encode("utf-8")
+        elif path == "/ready" and ready is not None:
+            status, body = ("200 OK", b"ready\n") if ready() else ("503 Service Unavailable", b"not ready\n")
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        warning("Metrics request failed: %s", repr(e))
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(addr: str, port: int,
+                               ready: Optional[Callable[[], bool]] = None) -> Optional[asyncio.AbstractServer]:
+    """Prometheus text format on http://addr:port/metrics, disabled when port is 0.
+    With ready, /ready answers 200 while it returns True and 503 otherwise.
+    None as well when the address can't be bound, the server runs on without metrics"""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(functools.partial(_serve_metrics, ready), addr, port)
+    except OSError as e:
+        warning("Metrics not available, could not listen on %s:%d: %s", addr, port, str(e))
+        return None
+    info("Metrics available at http://%s:%d/metrics", addr, port)
+    return server
@@ -0,0 +1,167 @@
+# page_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from logging import debug, info, warning
+from typing import Dict, NamedTuple, Optional
+
+from .env import env_int, env_str
+
+
+class CachedPage(NamedTuple):
+    content: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    raw_bytes: int
+
+
+class PageCache:
+    """Cleaned page text by URL, with the validators needed for conditional GETs.
+
+    Texts are stored zlib-compressed and keyed by their SHA-256, so mirrors
+    serving the same text share one copy. Least recently used pages are
+    evicted once the compressed texts exceed max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int, fresh_for: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, hash TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL NOT NULL, used_at REAL NOT NULL, raw_bytes INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS texts (hash TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used_at)")
+        self._db.commit()
+        info("PageCache opened at %s (max %d bytes)", path, max_bytes)
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """The cached page, None when there is none or the database is busy"""
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT texts.data, pages.etag, pages.last_modified, pages.fetched_at, pages.raw_bytes "
+                    "FROM pages JOIN texts ON texts.hash = pages.hash WHERE pages.url = ?", (url,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            warning("Failed to read cached page %s: %s", url, str(e))
+            return None
+        if row is None:
+            return None
+        data, etag, last_modified, fetched_at, raw_bytes = row
+        return CachedPage(zlib.decompress(data).decode("utf-8"), etag, last_modified, fetched_at, raw_bytes)
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.fresh_for
+
+    def record_hit(self, url: str, page: CachedPage, revalidated: bool) -> None:
+        """Count a served cached page, revalidated=True after a 304 answer.
+        The page is served anyway when its timestamps can't be updated"""
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.hits += 1
+            self.bytes_saved += page.raw_bytes
+            try:
+                if revalidated:
+                    self._db.execute("UPDATE pages SET used_at = ?, fetched_at = ? WHERE url = ?", (now, now, url))
+                else:
+                    self._db.execute("UPDATE pages SET used_at = ? WHERE url = ?", (now, url))
+                self._db.commit()
+            except sqlite3.Error as e:
+                warning("Failed to update cached page %s: %s", url, str(e))
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def put(self, url: str, content: str, etag: Optional[str], last_modified: Optional[str], raw_bytes: int) -> None:
+        encoded = content.encode("utf-8")
+        digest = hashlib.sha256(encoded).hexdigest()
+        now = time.time()
+        try:
+            with self._lock:
+                if self._db.execute("SELECT 1 FROM texts WHERE hash = ?", (digest,)).fetchone() is None:
+                    data = zlib.compress(encoded, 6)
+                    self._db.execute(
+                        "INSERT INTO texts (hash, data, size) VALUES (?, ?, ?)", (digest, data, len(data))
+                    )
+                else:
+                    debug("Text of %s already stored for another URL", url)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO pages (url, hash, etag, last_modified, fetched_at, used_at, raw_bytes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, digest, etag, last_modified, now, now, raw_bytes)
+                )
+                self._evict()
+                self._db.commit()
+        except sqlite3.Error as e:
+            warning("Failed to cache page %s: %s", url, str(e))
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, in self._db.execute("SELECT url FROM pages ORDER BY used_at").fetchall():
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._db.execute("DELETE FROM texts WHERE hash NOT IN (SELECT hash FROM pages)")
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+            if total <= self.max_bytes:
+                break
+        debug("Page cache evicted down to %d bytes", total)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pages, texts, size = self._db.execute(
+                "SELECT (SELECT COUNT(*) FROM pages), COUNT(*), COALESCE(SUM(size), 0) FROM texts"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "pages": pages,
+            "unique_texts": texts,
+            "stored_bytes": size
+        }
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """Process-wide page cache, None when SWUC_PAGE_CACHE_MAX_BYTES is 0"""
+    global _page_cache
+    max_bytes = env_int("SWUC_PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    if max_bytes <= 0:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache(
+                env_str("SWUC_PAGE_CACHE_PATH", os.path.join("cache", "pages.db")),
+                max_bytes,
+                env_int("SWUC_PAGE_CACHE_FRESH", 300)
+            )
+        return _page_cache
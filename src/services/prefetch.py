@@ -0,0 +1,209 @@
+# prefetch.py
+import asyncio
+import math
+import time
+from logging import debug, info, warning
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .env import env_float, env_int, worker_count
+from .quota import BACKGROUND, priority
+from .result_cache import get_cache_executor, normalize_name
+
+# Popularity scores are dropped for names not asked about in this many half-lives
+_FORGET_AFTER_HALF_LIVES = 8
+_MAX_TRACKED = 10000
+
+
+class PrefetchScheduler:
+    """Keeps the result cache warm for the most requested names.
+
+    Every request adds one to its name's score, scores halve every half_life
+    seconds. Every interval the hottest `size` names, plus pinned ones, whose
+    cache entry is missing or older than refresh_at of its TTL are looked up
+    again in the background. At most `budget` lookups are started per hour,
+    one at a time, and none while more than max_load of the lookup slots
+    are taken by clients."""
+
+    def __init__(self, size: int, budget: int, interval: float, half_life: float,
+                 refresh_at: float, max_load: float):
+        self.size = size
+        self.budget = budget
+        self.interval = interval
+        self.half_life = half_life
+        self.refresh_at = refresh_at
+        self.max_load = max_load
+        self.paused = False
+        self.pinned: Set[str] = set()
+        self.excluded: Set[str] = set()
+        self._scores: Dict[str, Tuple[float, float]] = {}
+        self._spellings: Dict[str, str] = {}
+        self._attempts: Dict[str, float] = {}
+        self._spent: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+        self._foreground = 0
+        self._capacity = 1
+        self.refreshed = 0
+        self.skipped_busy = 0
+
+    # Popularity
+
+    def record(self, name: str) -> None:
+        key = normalize_name(name)
+        now = time.monotonic()
+        score, seen = self._scores.get(key, (0.0, now))
+        self._scores[key] = (self._decay(score, now - seen) + 1.0, now)
+        self._spellings.setdefault(key, name)
+
+    def _decay(self, score: float, elapsed: float) -> float:
+        return score * math.pow(0.5, elapsed / self.half_life)
+
+    def score(self, key: str) -> float:
+        score, seen = self._scores.get(key, (0.0, time.monotonic()))
+        return self._decay(score, time.monotonic() - seen)
+
+    def hottest(self) -> List[str]:
+        ranked = sorted(
+            (key for key in self._scores if key not in self.excluded),
+            key=self.score, reverse=True
+        )
+        return ranked[:self.size]
+
+    def prefetch_set(self) -> List[str]:
+        hot = self.hottest()
+        return hot + sorted(self.pinned.difference(hot))
+
+    def _forget_cold(self) -> None:
+        now = time.monotonic()
+        horizon = self.half_life * _FORGET_AFTER_HALF_LIVES
+        for key, (_, seen) in list(self._scores.items()):
+            if now - seen > horizon and key not in self.pinned:
+                self._forget(key)
+        if len(self._scores) > _MAX_TRACKED:
+            ranked = sorted(self._scores, key=self.score, reverse=True)
+            for key in ranked[_MAX_TRACKED:]:
+                if key not in self.pinned:
+                    self._forget(key)
+
+    def _forget(self, key: str) -> None:
+        del self._scores[key]
+        self._spellings.pop(key, None)
+        self._attempts.pop(key, None)
+
+    # Foreground load
+
+    def lookup_started(self, capacity: int) -> None:
+        """Called for every client lookup that goes upstream"""
+        self._foreground += 1
+        self._capacity = capacity
+
+    def lookup_finished(self) -> None:
+        self._foreground -= 1
+
+    @property
+    def load(self) -> float:
+        return self._foreground / max(1, self._capacity)
+
+    # Budget
+
+    def budget_left(self) -> int:
+        hour_ago = time.monotonic() - 3600
+        self._spent = [started for started in self._spent if started > hour_ago]
+        return max(0, self.budget - len(self._spent))
+
+    # Scheduling
+
+    def start(self, finder_factory: Callable) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(finder_factory))
+            info("Prefetch scheduler started: %d names, %d lookups/hour", self.size, self.budget)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, finder_factory: Callable) -> None:
+        priority.set(BACKGROUND)
+        finder = None
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.paused:
+                continue
+            try:
+                if finder is None:
+                    finder = finder_factory()
+                await self._tick(finder)
+            except Exception as e:
+                warning("Prefetch round failed: %s", str(e))
+
+    async def due(self, cache) -> List[str]:
+        """Names of the prefetch set whose cache entry should be refreshed now, hottest first"""
+        now = time.monotonic()
+        # Looked up recently, maybe without success
+        keys = [key for key in self.prefetch_set()
+                if now - self._attempts.get(key, -math.inf) >= cache.error_ttl]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_cache_executor(), self._expiring, cache, keys)
+
+    def _expiring(self, cache, keys: List[str]) -> List[str]:
+        """keys whose cache entry is missing or older than refresh_at of its TTL.
+        Runs in a cache thread, the reads stay off the event loop"""
+        expiring = []
+        for key in keys:
+            cached = cache.get(key)
+            if cached is None or cached[1] >= cache.ttl * self.refresh_at:
+                expiring.append(key)
+        return expiring
+
+    async def _tick(self, finder) -> None:
+        self._forget_cold()
+        for key in await self.due(finder.cache):
+            if self.paused:
+                return
+            if self.load > self.max_load:
+                self.skipped_busy += 1
+                debug("Prefetch backing off, foreground load %.0f%%", self.load * 100)
+                return
+            if not self.budget_left():
+                debug("Prefetch budget of %d lookups/hour used up", self.budget)
+                return
+
+            now = time.monotonic()
+            self._spent.append(now)
+            self._attempts[key] = now
+            info("Prefetching '%s'", key)
+            await finder.refresh(self._spellings.get(key, key))
+            self.refreshed += 1
+
+    def stats(self) -> Dict:
+        return {
+            "size": self.size,
+            "budget": self.budget,
+            "budget_left": self.budget_left(),
+            "paused": self.paused,
+            "load": self.load,
+            "tracked": len(self._scores),
+            "refreshed": self.refreshed,
+            "skipped_busy": self.skipped_busy
+        }
+
+
+_prefetcher: Optional[PrefetchScheduler] = None
+
+
+def get_prefetcher() -> PrefetchScheduler:
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = PrefetchScheduler(
+            size=env_int("SWUC_PREFETCH_SIZE", 200),
+            budget=max(1, env_int("SWUC_PREFETCH_BUDGET", 600) // worker_count()),
+            interval=env_float("SWUC_PREFETCH_INTERVAL", 30.0),
+            half_life=env_float("SWUC_PREFETCH_HALF_LIFE", 86400.0),
+            refresh_at=env_float("SWUC_PREFETCH_REFRESH_AT", 0.8),
+            max_load=env_float("SWUC_PREFETCH_MAX_LOAD", 0.5)
+        )
+    return _prefetcher
@@ -0,0 +1,199 @@
+# quota.py
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from logging import debug, info, warning
+from typing import Dict, List, Optional, Tuple
+
+from .env import env_float, worker_count
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the upstream calls made in the current context. Set it to
+# BACKGROUND in tasks no client is waiting for, _run_blocking carries it
+# into worker threads
+priority = contextvars.ContextVar("swuc_priority", default=INTERACTIVE)
+
+# Defaults per API: (requests per second, burst)
+QUOTA_DEFAULTS = {
+    "search": (5.0, 10.0),
+    "safety": (10.0, 20.0),
+    "gpt": (10.0, 10.0),
+}
+
+# Used when a 429 answer has no usable Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class QuotaTimeout(Exception):
+    """No request slot of an API became free before the caller's deadline"""
+
+    def __init__(self, api: str, waited: float, retry_after: float):
+        super().__init__(f"{api} quota exhausted after waiting {waited:.1f}s")
+        self.api = api
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Seconds from a Retry-After header, either delay-seconds or an HTTP date"""
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """Request rate limit of one API, shared by every thread calling it.
+
+    Callers queue by priority, then arrival. A caller that can't get a token
+    before its deadline gets QuotaTimeout instead of a request. hold() stops
+    handing out tokens until a Retry-After delay has passed. A rate of 0
+    means no limit, but Retry-After is still honoured."""
+
+    def __init__(self, api: str, rate: float, burst: float, max_wait: Dict[int, float]):
+        self.api = api
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_wait = max_wait
+        self.tokens = self.burst
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.granted = 0
+        self.queued = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.throttled = 0
+
+    def deadline(self) -> float:
+        return time.monotonic() + self.max_wait.get(priority.get(), self.max_wait[INTERACTIVE])
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _wait_for_turn(self, now: float) -> float:
+        """Seconds until the head of the queue may go, 0 when it may go now"""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.rate <= 0 or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self, deadline: Optional[float] = None) -> None:
+        started = time.monotonic()
+        if deadline is None:
+            deadline = self.deadline()
+        ticket = (priority.get(), next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = None
+                    if self._queue[0] == ticket:
+                        wait = self._wait_for_turn(now)
+                        if wait == 0:
+                            if self.rate > 0:
+                                self.tokens -= 1
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise QuotaTimeout(self.api, now - started, self._retry_hint(now))
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            self.granted += 1
+            if waited > 0.001:
+                self.queued += 1
+                self.wait_time += waited
+                debug("Waited %.3fs for %s quota", waited, self.api)
+
+    def _retry_hint(self, now: float) -> float:
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.rate > 0:
+            return len(self._queue) / self.rate
+        return DEFAULT_RETRY_AFTER
+
+    def hold(self, seconds: float) -> None:
+        """The API answered 429, hand out no tokens for seconds"""
+        with self._cond:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self._cond.notify_all()
+        warning("%s API throttled us, pausing it for %.1fs", self.api, seconds)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for level, _ in self._queue:
+                waiting[PRIORITY_NAMES.get(level, str(level))] += 1
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 1),
+                "granted": self.granted,
+                "queued": self.queued,
+                "avg_wait": round(self.wait_time / self.queued, 3) if self.queued else 0.0,
+                "timeouts": self.timeouts,
+                "throttled": self.throttled,
+                "paused_for": round(max(0.0, self._blocked_until - now), 1),
+                "waiting": waiting
+            }
+
+
+_quotas: Dict[str, TokenBucket] = {}
+_quotas_lock = threading.Lock()
+
+
+def get_quota(api: str) -> Optional[TokenBucket]:
+    """Token bucket of an API listed in QUOTA_DEFAULTS, None for other services"""
+    if api not in QUOTA_DEFAULTS:
+        return None
+    with _quotas_lock:
+        if api not in _quotas:
+            rate, burst = QUOTA_DEFAULTS[api]
+            prefix = f"SWUC_QUOTA_{api.upper()}"
+            # The quota is per API key, every worker process gets its share
+            workers = worker_count()
+            _quotas[api] = TokenBucket(
+                api,
+                env_float(f"{prefix}_RATE", rate) / workers,
+                env_float(f"{prefix}_BURST", burst) / workers,
+                {
+                    INTERACTIVE: env_float("SWUC_QUOTA_INTERACTIVE_WAIT", 10.0),
+                    BACKGROUND: env_float("SWUC_QUOTA_BACKGROUND_WAIT", 60.0)
+                }
+            )
+            info("Quota for %s: %.1f requests/s, burst %.0f", api, _quotas[api].rate, _quotas[api].burst)
+        return _quotas[api]
+
+
+def quota_stats() -> Dict[str, Dict]:
+    with _quotas_lock:
+        quotas = dict(_quotas)
+    return {api: bucket.stats() for api, bucket in quotas.items()}
@@ -0,0 +1,200 @@
+# result_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import debug, info, warning
+from typing import Dict, Optional, Tuple
+
+from .env import env_int, env_str, worker_count
+
+FRESH = "fresh"
+STALE = "stale"
+# Threads running cache calls for the event loop, the database is used by one at a time anyway
+CACHE_THREADS = 2
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.split()).lower()
+
+
+class ResultCache:
+    """find_version results shared by all connections and kept on disk between restarts.
+
+    With shared=True several worker processes use the same database, and a
+    lookup in progress is announced with a lease so the other workers wait
+    for its result instead of repeating it."""
+
+    def __init__(self, path: str, ttl: int = 21600, error_ttl: int = 300, stale_ttl: int = 86400,
+                 shared: bool = False, lease_ttl: int = 120):
+        self.path = path
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        self.lease_ttl = lease_ttl
+        self._owner = str(os.getpid())
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, is_error INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.commit()
+        info("ResultCache opened at %s (ttl %ds, error ttl %ds, stale %ds)",
+             path, ttl, error_ttl, stale_ttl)
+
+    def get(self, name: str) -> Optional[Tuple[Dict, float, str]]:
+        """Return (result, age in seconds, FRESH|STALE) or None when there is
+        nothing usable, or the database is busy"""
+        key = normalize_name(name)
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT payload, stored_at, is_error FROM results WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            warning("Failed to read cached result for '%s': %s", key, str(e))
+            return None
+        if row is None:
+            return None
+
+        payload, stored_at, is_error = row
+        age = max(0.0, time.time() - stored_at)
+        if is_error:
+            if age < self.error_ttl:
+                return json.loads(payload), age, FRESH
+            return None
+
+        if age < self.ttl:
+            return json.loads(payload), age, FRESH
+        if age < self.ttl + self.stale_ttl:
+            return json.loads(payload), age, STALE
+        return None
+
+    def set(self, name: str, result: Dict) -> None:
+        """Store result. An error never replaces a found version that can still
+        be served, a failed refresh keeps the good entry"""
+        key = normalize_name(name)
+        is_error = 1 if result.get("error") else 0
+        now = time.time()
+        try:
+            with self._lock:
+                cursor = self._db.execute(
+                    "INSERT INTO results (key, payload, stored_at, is_error) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET payload = excluded.payload, "
+                    "stored_at = excluded.stored_at, is_error = excluded.is_error "
+                    "WHERE excluded.is_error = 0 OR results.is_error = 1 OR results.stored_at < ?",
+                    (key, json.dumps(result), now, is_error, now - self.ttl - self.stale_ttl)
+                )
+                self._db.commit()
+            if cursor.rowcount:
+                debug("Cached result for '%s' (error: %d)", key, is_error)
+            else:
+                debug("Kept the cached version of '%s' over a failed lookup", key)
+        except sqlite3.Error as e:
+            warning("Failed to cache result for '%s': %s", key, str(e))
+
+    def claim(self, name: str) -> bool:
+        """Take the lease for looking name up, False while another process holds it"""
+        key = normalize_name(name)
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                    (key, self._owner, now + self.lease_ttl)
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            warning("Failed to claim lookup of '%s': %s", key, str(e))
+            return True  # Rather look it up twice than not at all
+        return cursor.rowcount == 1
+
+    def claimed(self, name: str) -> bool:
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT 1 FROM leases WHERE key = ? AND expires >= ?", (normalize_name(name), time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            warning("Failed to check lookup of '%s': %s", name, str(e))
+            return False  # Stop waiting and look it up
+        return row is not None
+
+    def release(self, name: str) -> None:
+        try:
+            with self._lock:
+                self._db.execute(
+                    "DELETE FROM leases WHERE key = ? AND owner = ?", (normalize_name(name), self._owner)
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            warning("Failed to release lookup of '%s': %s", name, str(e))
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        try:
+            with self._lock:
+                cursor = self._db.execute(
+                    "DELETE FROM results WHERE (is_error = 1 AND stored_at < ?) "
+                    "OR (is_error = 0 AND stored_at < ?)",
+                    (now - self.error_ttl, now - self.ttl - self.stale_ttl)
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            warning("Failed to purge expired results: %s", str(e))
+            return 0
+        return cursor.rowcount
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+_cache_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_cache_executor() -> ThreadPoolExecutor:
+    """Threads of their own for result cache calls, so a cache hit never
+    queues behind page fetches of cold lookups"""
+    global _cache_executor
+    with _result_cache_lock:
+        if _cache_executor is None:
+            _cache_executor = ThreadPoolExecutor(max_workers=CACHE_THREADS, thread_name_prefix="swuc-cache")
+        return _cache_executor
+
+
+def shutdown_cache_executor() -> None:
+    global _cache_executor
+    with _result_cache_lock:
+        if _cache_executor is not None:
+            _cache_executor.shutdown(wait=False, cancel_futures=True)
+            _cache_executor = None
+
+
+def get_result_cache() -> ResultCache:
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                env_str("SWUC_RESULT_CACHE_PATH", os.path.join("cache", "results.db")),
+                ttl=env_int("SWUC_RESULT_CACHE_TTL", 21600),
+                error_ttl=env_int("SWUC_RESULT_CACHE_ERROR_TTL", 300),
+                stale_ttl=env_int("SWUC_RESULT_CACHE_STALE_TTL", 86400),
+                shared=worker_count() > 1,
+                lease_ttl=env_int("SWUC_LOOKUP_LEASE_TTL", 120)
+            )
+            _result_cache.purge_expired()
+        return _result_cache
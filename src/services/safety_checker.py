@@ -1,21 +1,94 @@
 # safety_checker.py
-import requests
+import asyncio
+import threading
+import time
 from logging import debug, info, warning, error
-from typing import List, Dict
+from typing import List, Dict, Optional
+from urllib.parse import urlparse
+
+from .env import env_bool, env_int, env_str
+from .http_client import get_http_client
+from .metrics import cache_result
+
+MAX_BATCH = 500
+SAFETY_URL = "https://sba.yandex.net/v4/threatMatches:find"
+
+
+def _page(url: str) -> str:
+    """url without scheme, query and fragment: the page whatever it was asked with"""
+    parsed = urlparse(url)
+    return (parsed.hostname or "").lower() + (parsed.path or "/")
+
+
+class VerdictCache:
+    """Safe Browsing verdicts by URL, and unsafe pages.
+
+    A safe verdict holds for its URL only, other pages of a host can serve
+    anything. An unsafe one holds for its page, query strings aside, and
+    never for the rest of its domain: one bad upload must not block a code
+    host for a day."""
+
+    def __init__(self, safe_ttl: int, unsafe_ttl: int):
+        self.safe_ttl = safe_ttl
+        self.unsafe_ttl = unsafe_ttl
+        self._urls: Dict[str, float] = {}
+        self._unsafe_pages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[bool]:
+        now = time.monotonic()
+        with self._lock:
+            if self._unsafe_pages.get(_page(url), 0) > now:
+                verdict = False
+            elif self._urls.get(url, 0) > now:
+                verdict = True
+            else:
+                verdict = None
+            if verdict is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            cache_result("verdict", verdict is not None)
+            return verdict
+
+    def put(self, url: str, safe: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if safe:
+                self._urls[url] = now + self.safe_ttl
+            else:
+                self._unsafe_pages[_page(url)] = now + self.unsafe_ttl
+                self._urls.pop(url, None)
+            for verdicts in (self._urls, self._unsafe_pages):
+                if len(verdicts) > 100000:
+                    for key in [key for key, expires in verdicts.items() if expires <= now]:
+                        del verdicts[key]
+
 
 class SafetyChecker:
     def __init__(self, api_key: str):
         self.api_key = api_key
+        self.http = get_http_client().client("safety")
+        self.url = env_str("SWUC_SAFETY_URL", SAFETY_URL)
+        self.enabled = env_bool("SWUC_SAFETY_CHECK", True) and bool(api_key)
+        self.fail_open = env_bool("SWUC_SAFETY_FAIL_OPEN", True)
+        self.verdicts = get_verdict_cache()
         info("SafetyChecker initialized with API key: %s", api_key[:4]+"***")
 
-    def check_batch(self, urls: List[str], batch_size: int = 500) -> Dict[str, bool]:
+    def check_batch(self, urls: List[str], batch_size: int = MAX_BATCH) -> Dict[str, bool]:
         """Batch URL safety check"""
+        return {url: bool(safe) for url, safe in self._check_batch(urls, batch_size).items()}
+
+    def _check_batch(self, urls: List[str], batch_size: int = MAX_BATCH) -> Dict[str, Optional[bool]]:
+        """Batch URL safety check, None for URLs whose check failed"""
         info("Starting safety check for %d URLs", len(urls))
         results = {}
         for batch_num, i in enumerate(range(0, len(urls), batch_size), 1):
             batch = urls[i:i+batch_size]
             debug("Processing batch %d with %d URLs", batch_num, len(batch))
-            
+
             payload = {
                 "client": {"clientId": "version_checker", "clientVersion": "1.0"},
                 "threatInfo": {
@@ -23,27 +96,29 @@ class SafetyChecker:
                     "threatEntries": [{"url": url} for url in batch]
                 }
             }
-            
+
             try:
-                response = requests.post(
-                    "https://sba.yandex.net/v4/threatMatches:find",
+                response = self.http.post(
+                    self.url,
                     params={"key": self.api_key},
-                    json=payload,
-                    timeout=15
+                    json=payload
                 )
-                debug("Safety API response for batch %d: %d", 
+                debug("Safety API response for batch %d: %d",
                             batch_num, response.status_code)
+                response.raise_for_status()
                 batch_result = self.process_batch(response.json(), batch)
                 results.update(batch_result)
-                
+                for url, safe in batch_result.items():
+                    self.verdicts.put(url, safe)
+
                 safe_count = sum(batch_result.values())
-                info("Batch %d: %d/%d URLs safe", 
+                info("Batch %d: %d/%d URLs safe",
                            batch_num, safe_count, len(batch))
-                
+
             except Exception as e:
-                error("Safety check failed for batch %d: %s", 
+                error("Safety check failed for batch %d: %s",
                             batch_num, str(e), exc_info=True)
-                results.update({url: False for url in batch})
+                results.update({url: None for url in batch})
         return results
 
     def process_batch(self, response_data: Dict, batch: List[str]) -> Dict[str, bool]:
@@ -57,3 +132,99 @@ class SafetyChecker:
                 safe_results[unsafe_url] = False
                 debug("Marked as unsafe: %s", unsafe_url)
         return safe_results
+
+    def _allowed(self, url: str, safe: Optional[bool]) -> bool:
+        if safe is None:
+            return self.fail_open
+        return safe
+
+    async def filter_safe_async(self, urls: List[str]) -> List[str]:
+        """URLs considered safe, asking the API only for ones without a cached
+        verdict; uncached URLs of all concurrent lookups are sent together"""
+        if not self.enabled:
+            return urls
+        verdicts = {url: self.verdicts.get(url) for url in urls}
+        unknown = [url for url, safe in verdicts.items() if safe is None]
+        if unknown:
+            batcher = get_safety_batcher(self)
+            answers = await asyncio.gather(*(batcher.check(url) for url in unknown))
+            verdicts.update(zip(unknown, answers))
+        return [url for url in urls if self._allowed(url, verdicts.get(url))]
+
+
+class SafetyBatcher:
+    """Gathers URLs from concurrent lookups for a short window and checks them
+    in one check_batch call of up to MAX_BATCH entries"""
+
+    def __init__(self, checker: SafetyChecker, window: float, max_batch: int):
+        self.checker = checker
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: List[str] = []
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batches = 0
+        self.urls_checked = 0
+
+    def check(self, url: str) -> asyncio.Future:
+        waiting = self._waiting.get(url)
+        if waiting is not None:
+            return waiting  # Already queued or being checked for another lookup
+
+        loop = asyncio.get_running_loop()
+        future = self._waiting[url] = loop.create_future()
+        self._queue.append(url)
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[str]) -> None:
+        self.batches += 1
+        self.urls_checked += len(batch)
+        verdicts: Dict[str, Optional[bool]] = {}
+        try:
+            loop = asyncio.get_running_loop()
+            verdicts = await loop.run_in_executor(None, self.checker._check_batch, batch, self.max_batch)
+        finally:
+            for url in batch:
+                future = self._waiting.pop(url, None)
+                if future is not None and not future.done():
+                    future.set_result(verdicts.get(url))
+
+
+_verdict_cache: Optional[VerdictCache] = None
+_safety_batcher: Optional[SafetyBatcher] = None
+
+
+def get_verdict_cache() -> VerdictCache:
+    global _verdict_cache
+    if _verdict_cache is None:
+        _verdict_cache = VerdictCache(
+            env_int("SWUC_SAFETY_TTL", 21600),
+            env_int("SWUC_SAFETY_UNSAFE_TTL", 86400)
+        )
+    return _verdict_cache
+
+
+def get_safety_batcher(checker: SafetyChecker) -> SafetyBatcher:
+    global _safety_batcher
+    if _safety_batcher is None:
+        _safety_batcher = SafetyBatcher(
+            checker,
+            env_int("SWUC_SAFETY_BATCH_WINDOW_MS", 20) / 1000,
+            min(MAX_BATCH, env_int("SWUC_SAFETY_BATCH_SIZE", MAX_BATCH))
+        )
+    return _safety_batcher
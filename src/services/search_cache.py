@@ -0,0 +1,164 @@
+# search_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logging import debug, info, warning
+from typing import List, NamedTuple, Optional
+
+from .env import env_int, env_str, worker_count
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).lower()
+
+
+class _Entry(NamedTuple):
+    urls: List[str]
+    max_results: int
+    stored_at: float
+
+    def covers(self, max_results: int) -> bool:
+        # Fewer URLs than asked for means the search had nothing more to give
+        return max_results <= self.max_results or len(self.urls) < self.max_results
+
+
+class SearchCache:
+    """Search results by normalized query, shared by every SearchManager.
+
+    One entry per query holds the URLs of the largest max_results searched,
+    smaller requests are served from its prefix. Empty results, which is
+    also what a failed search returns, expire after negative_ttl. With a
+    path the entries are also kept in SQLite and survive restarts."""
+
+    def __init__(self, ttl: int, negative_ttl: int, max_entries: int, path: Optional[str] = None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "query TEXT PRIMARY KEY, urls TEXT NOT NULL, "
+                "max_results INTEGER NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        info("SearchCache: ttl %ds, negative ttl %ds, %s", ttl, negative_ttl,
+             f"persisted to {path}" if path else "memory only")
+
+    def _expired(self, entry: _Entry) -> bool:
+        ttl = self.ttl if entry.urls else self.negative_ttl
+        return time.time() - entry.stored_at >= ttl
+
+    def _load(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT urls, max_results, stored_at FROM searches WHERE query = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                entry = _Entry(json.loads(row[0]), row[1], row[2])
+                self._remember(key, entry)
+        if entry is not None and self._expired(entry):
+            return None
+        return entry
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def preload(self) -> int:
+        """Load the most recent persisted entries into memory, returns how many"""
+        if self._db is None:
+            return 0
+        loaded = 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT query, urls, max_results, stored_at FROM searches ORDER BY stored_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            for key, urls, max_results, stored_at in reversed(rows):
+                entry = _Entry(json.loads(urls), max_results, stored_at)
+                if not self._expired(entry):
+                    self._remember(key, entry)
+                    loaded += 1
+        return loaded
+
+    def get(self, query: str, max_results: int) -> Optional[List[str]]:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._load(key)
+            if entry is None or not entry.covers(max_results):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.urls:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+        debug("Search cache hit for '%s' (%d of %d results)", key, max_results, entry.max_results)
+        return entry.urls[:max_results]
+
+    def put(self, query: str, max_results: int, urls: List[str]) -> None:
+        key = normalize_query(query)
+        with self._lock:
+            current = self._load(key)
+            if current is not None and current.urls and not urls:
+                return  # Keep good results over a failed or empty refresh
+            if current is not None and current.urls and current.max_results > max_results:
+                return  # Keep the entry that covers more requests
+            entry = _Entry(list(urls), max_results, time.time())
+            self._remember(key, entry)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO searches (query, urls, max_results, stored_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(entry.urls), entry.max_results, entry.stored_at)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                warning("Failed to persist search results for '%s': %s", key, str(e))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses
+            }
+
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(
+                env_int("SWUC_SEARCH_CACHE_TTL", 21600),
+                env_int("SWUC_SEARCH_CACHE_NEGATIVE_TTL", 120),
+                env_int("SWUC_SEARCH_CACHE_ENTRIES", 4096),
+                # Worker processes share search results through SQLite
+                env_str("SWUC_SEARCH_CACHE_PATH", "")
+                or (os.path.join("cache", "searches.db") if worker_count() > 1 else None)
+            )
+        return _search_cache
@@ -1,20 +1,43 @@
 # search_manager.py
-import requests
 import xml.etree.ElementTree as ET
 from logging import debug, info, warning, error
 from urllib.parse import urlparse
-from functools import lru_cache
 from typing import List
 
+from .env import env_str
+from .http_client import get_http_client
+from .quota import QuotaTimeout
+from .metrics import cache_result
+from .search_cache import get_search_cache, normalize_query
+from .singleflight import SingleFlight
+
+_search_flight = SingleFlight("search")
+
+SEARCH_URL = "https://yandex.ru/search/xml"
+
 class SearchManager:
     def __init__(self, folder_id: str, api_key: str):
         self.folder_id = folder_id
         self.api_key = api_key
+        self.http = get_http_client().client("search")
+        self.url = env_str("SWUC_SEARCH_URL", SEARCH_URL)
+        self.cache = get_search_cache()
         info("SearchManager initialized with folder ID: %s", folder_id[:4]+"***")
 
-    @lru_cache(maxsize=128)
     def search_urls(self, query: str, max_results: int = 5) -> List[str]:
-        """Execute search with result limitation"""
+        """Execute search with result limitation, cached and with identical concurrent searches run once"""
+        urls = self.cache.get(query, max_results)
+        cache_result("search", urls is not None)
+        if urls is not None:
+            return urls
+        return _search_flight.do((normalize_query(query), max_results), self._search_and_cache, query, max_results)
+
+    def _search_and_cache(self, query: str, max_results: int) -> List[str]:
+        urls = self._search(query, max_results)
+        self.cache.put(query, max_results, urls)
+        return urls
+
+    def _search(self, query: str, max_results: int) -> List[str]:
         info("Searching for '%s' with max %d results", query, max_results)
         params = {
             "folderid": self.folder_id,
@@ -25,13 +48,14 @@ class SearchManager:
 
         try:
             debug("Sending search request to Yandex XML API")
-            response = requests.get(
-                "https://yandex.ru/search/xml",
-                params=params,
-                timeout=10
+            response = self.http.get(
+                self.url,
+                params=params
             )
             info("Search API response status: %d", response.status_code)
             return self.parse_results(response.content, max_results)
+        except QuotaTimeout:
+            raise  # Not an empty result, nothing to cache
         except Exception as e:
             error("Search request failed: %s", str(e), exc_info=True)
             return []
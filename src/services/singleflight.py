@@ -0,0 +1,100 @@
+# singleflight.py
+import asyncio
+import threading
+from logging import debug
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+_flights: List["_FlightCounters"] = []
+
+
+class _FlightCounters:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        _flights.append(self)
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls)
+        }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(_FlightCounters):
+    """Concurrent calls with the same key from worker threads share one execution"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable, *args) -> Any:
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            debug("%s: waiting for in-flight call %s", self.name, key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(_FlightCounters):
+    """Concurrent awaits with the same key share one task, which keeps
+    running for the others if one waiter is cancelled"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+            debug("%s: waiting for in-flight call %s", self.name, key)
+        return await asyncio.shield(task)
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+def singleflight_stats() -> Dict[str, Dict]:
+    return {flight.name: flight.stats() for flight in _flights}
@@ -0,0 +1,216 @@
+# sources.py
+import json
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from logging import debug, info, warning
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+import requests
+
+from .env import env_bool, env_str
+from .http_client import ServiceClient, get_http_client
+from .metrics import SOURCE_LOOKUPS
+from .result_cache import normalize_name
+
+# "pypi:requests", "npm: left-pad", "github:owner/repo"
+_HINT = re.compile(r'^\s*([a-z]+)\s*:\s*(\S.*?)\s*$', re.IGNORECASE)
+_STABLE_VERSION = re.compile(r'(?<![\w.])v?(\d+(?:\.\d+)+)$', re.IGNORECASE)
+# Pre-release marker attached to a version in a tag or release title: v2.0.0-rc1,
+# 1.0a1, "3.0 beta". Not a marker elsewhere in the name: "pre-commit v4.0.1", "Prettier 3.3.2"
+_PRERELEASE = re.compile(
+    r'\d[-._+ ]?(alpha|beta|preview|pre|rc|dev|nightly|insider|snapshot|a(?=\d)|b(?=\d))(?![a-z])',
+    re.IGNORECASE
+)
+_ATOM = {"atom": "http://www.w3.org/2005/Atom"}
+
+
+class Found(NamedTuple):
+    version: str
+    sources: List[str]
+
+
+class Source(ABC):
+    """Adapter of one registry answering "latest version of package" in one request.
+
+    name is what the lookup reports as its resolver, aliases are the hints
+    accepted in front of a package ("pip:requests"). The endpoint defaults to
+    the public registry and is read from SWUC_SOURCE_<NAME>_URL."""
+
+    name = ""
+    aliases: Tuple[str, ...] = ()
+    default_endpoint = ""
+
+    def __init__(self, http: ServiceClient, endpoint: Optional[str] = None):
+        self.http = http
+        self.endpoint = (endpoint or env_str(f"SWUC_SOURCE_{self.name.upper()}_URL", self.default_endpoint)).rstrip("/")
+
+    @abstractmethod
+    def latest(self, package: str) -> Optional[Found]:
+        """Latest stable version of package, None when the registry doesn't know it"""
+
+    def _get(self, url: str) -> Optional[requests.Response]:
+        response = self.http.get(url, headers={"User-Agent": "swuc-version-checker"})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response
+
+
+class PyPI(Source):
+    name = "pypi"
+    aliases = ("pypi", "pip", "python")
+    default_endpoint = "https://pypi.org"
+
+    def latest(self, package: str) -> Optional[Found]:
+        url = f"{self.endpoint}/pypi/{quote(package)}/json"
+        response = self._get(url)
+        if response is None:
+            return None
+        version = response.json()["info"]["version"]
+        return Found(version, [f"{self.endpoint}/project/{quote(package)}/", url])
+
+
+class Npm(Source):
+    name = "npm"
+    aliases = ("npm", "node")
+    default_endpoint = "https://registry.npmjs.org"
+
+    def latest(self, package: str) -> Optional[Found]:
+        # Scoped packages keep their slash here: /-/package/@scope/name/dist-tags
+        url = f"{self.endpoint}/-/package/{quote(package, safe='@/')}/dist-tags"
+        response = self._get(url)
+        if response is None:
+            return None
+        version = response.json().get("latest")
+        if not version:
+            return None
+        return Found(version, [f"https://www.npmjs.com/package/{package}", url])
+
+
+class GitHubReleases(Source):
+    name = "github"
+    aliases = ("github", "gh")
+    default_endpoint = "https://github.com"
+
+    def latest(self, package: str) -> Optional[Found]:
+        repo = package.strip("/")
+        if repo.count("/") != 1:
+            return None  # Needs owner/repo
+        url = f"{self.endpoint}/{quote(repo)}/releases.atom"
+        response = self._get(url)
+        if response is None:
+            return None
+        # Newest release first, skip the ones whose tag or title is a pre-release
+        for entry in ET.fromstring(response.content).findall("atom:entry", _ATOM):
+            link = entry.find("atom:link", _ATOM)
+            href = link.get("href", "") if link is not None else ""
+            tag = href.rsplit("/", 1)[-1]
+            title = entry.findtext("atom:title", "", _ATOM)
+            if _PRERELEASE.search(tag) or _PRERELEASE.search(title):
+                continue
+            match = _STABLE_VERSION.search(tag)
+            if match:
+                return Found(match.group(1), [href or f"{self.endpoint}/{repo}/releases", url])
+        return None
+
+
+class Crates(Source):
+    name = "crates"
+    aliases = ("crates", "crate", "cargo", "rust")
+    default_endpoint = "https://crates.io"
+
+    def latest(self, package: str) -> Optional[Found]:
+        url = f"{self.endpoint}/api/v1/crates/{quote(package)}"
+        response = self._get(url)
+        if response is None:
+            return None
+        crate = response.json()["crate"]
+        version = crate.get("max_stable_version") or crate.get("newest_version")
+        if not version:
+            return None
+        return Found(version, [f"{self.endpoint}/crates/{quote(package)}", url])
+
+
+class SourceRegistry:
+    """Structured sources tried before the search pipeline.
+
+    A name is routed to a source by an ecosystem hint ("npm:react") or by the
+    local mapping table, a JSON object of names to "ecosystem:package"
+    ({"django": "pypi:django", "vs code": "github:microsoft/vscode"})."""
+
+    def __init__(self, mapping_path: Optional[str] = None):
+        self._sources: Dict[str, Source] = {}
+        self._aliases: Dict[str, str] = {}
+        self.mapping: Dict[str, str] = {}
+        if mapping_path and os.path.exists(mapping_path):
+            try:
+                with open(mapping_path, "r", encoding="utf-8") as mapping_file:
+                    self.mapping = {normalize_name(k): v for k, v in json.load(mapping_file).items()}
+                info("Loaded %d structured source mappings from %s", len(self.mapping), mapping_path)
+            except (OSError, ValueError, AttributeError) as e:
+                warning("Could not load source mappings from %s: %s", mapping_path, str(e))
+
+    def register(self, source: Source) -> None:
+        self._sources[source.name] = source
+        for alias in (source.name, *source.aliases):
+            self._aliases[alias] = source.name
+
+    def route(self, software_name: str) -> Optional[Tuple[Source, str]]:
+        """The source and package name software_name stands for, if any"""
+        target = self.mapping.get(normalize_name(software_name), software_name)
+        hint = _HINT.match(target)
+        if hint is None:
+            return None
+        source = self._aliases.get(hint.group(1).lower())
+        if source is None:
+            return None
+        return self._sources[source], hint.group(2)
+
+    def search_name(self, software_name: str) -> str:
+        """What the search pipeline looks for: the package without its hint"""
+        hint = _HINT.match(software_name)
+        if hint is not None and hint.group(1).lower() in self._aliases:
+            return hint.group(2)
+        return software_name
+
+    def lookup(self, software_name: str) -> Optional[Tuple[str, Found]]:
+        """(source name, result) from the structured source of software_name,
+        None when it has none or the source can't answer"""
+        routed = self.route(software_name)
+        if routed is None:
+            return None
+        source, package = routed
+        try:
+            found = source.latest(package)
+        except Exception as e:
+            SOURCE_LOOKUPS.inc(source=source.name, result="error")
+            warning("%s lookup of '%s' failed: %s", source.name, package, str(e))
+            return None
+        SOURCE_LOOKUPS.inc(source=source.name, result="found" if found else "missing")
+        if found is None:
+            debug("%s has no package '%s'", source.name, package)
+            return None
+        info("%s: %s is at %s", source.name, package, found.version)
+        return source.name, found
+
+
+_registry: Optional[SourceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_source_registry() -> Optional[SourceRegistry]:
+    """Registry with the built-in sources, None when SWUC_STRUCTURED_SOURCES is off"""
+    global _registry
+    if not env_bool("SWUC_STRUCTURED_SOURCES", True):
+        return None
+    with _registry_lock:
+        if _registry is None:
+            http = get_http_client().client("sources")
+            _registry = SourceRegistry(env_str("SWUC_SOURCES_MAP", "sources.json"))
+            for source in (PyPI, Npm, GitHubReleases, Crates):
+                _registry.register(source(http))
+        return _registry
@@ -0,0 +1,116 @@
+# version_resolver.py
+import re
+from logging import debug, info
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .env import env_float, env_int
+
+_VERSION = re.compile(
+    r'(?<![\w.])v?(\d+(?:\.\d+)+)(?:[-.]?(alpha|beta|preview|pre|rc|dev|nightly|a(?=\d)|b(?=\d))\d*)?(?![\w.]*\d)',
+    re.IGNORECASE
+)
+_NAME_TOKEN = re.compile(r'[a-z0-9]+')
+_PRERELEASE_WORDS = re.compile(r'\b(alpha|beta|preview|pre-release|prerelease|rc\d*|nightly|dev|insider)\b', re.IGNORECASE)
+_LATEST_WORDS = re.compile(r'\b(latest|stable|current|lts|released?|последн\w*|стабильн\w*)\b', re.IGNORECASE)
+# Characters between the name and a version at which the version's closeness point is halved
+_NEAR = 30
+
+
+class Resolution(NamedTuple):
+    version: Optional[str]
+    confidence: float
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    parts = [int(part) for part in version.split('.')]
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+class VersionResolver:
+    """Picks a version from extracted candidates without the LLM when the pages agree.
+
+    Every candidate naming the software is evidence for the versions in it,
+    pre-releases are dropped. A version scores one point per mention, up to
+    one more the closer it is to the name, and one when "latest"/"stable"-like
+    words are next to it. Confidence combines the winner's share of the score
+    with the share of analyzed pages backing it, and is halved when a newer
+    version was also seen for the same software. The LLM is skipped only when
+    at least SWUC_RESOLVER_MIN_PAGES pages back the winner."""
+
+    def __init__(self, threshold: Optional[float] = None, min_pages: Optional[int] = None):
+        self.threshold = env_float("SWUC_RESOLVER_CONFIDENCE", 0.75) if threshold is None else threshold
+        self.min_pages = env_int("SWUC_RESOLVER_MIN_PAGES", 2) if min_pages is None else min_pages
+
+    @staticmethod
+    def _name_spans(name_tokens: List[str], candidate: str) -> List[Tuple[int, int]]:
+        """Where the name's words are in candidate, empty unless all of them are"""
+        spans = [match.span() for match in _NAME_TOKEN.finditer(candidate.lower())
+                 if match.group(0) in name_tokens]
+        found = {candidate[start:end].lower() for start, end in spans}
+        return spans if all(token in found for token in name_tokens) else []
+
+    @staticmethod
+    def _closeness(name_spans: List[Tuple[int, int]], start: int, end: int) -> float:
+        """1.0 for a version right next to the name, halved _NEAR characters away"""
+        distance = min(max(0, start - span_end, span_start - end) for span_start, span_end in name_spans)
+        return _NEAR / (_NEAR + distance)
+
+    def resolve(self, name: str, candidates_per_page: List[List[str]]) -> Resolution:
+        return self._resolve(name, candidates_per_page)[0]
+
+    def _resolve(self, name: str, candidates_per_page: List[List[str]]) -> Tuple[Resolution, int]:
+        """Resolution and the number of pages backing its version"""
+        name_tokens = _NAME_TOKEN.findall(name.lower())
+        if not name_tokens:
+            return Resolution(None, 0.0), 0
+
+        scores: Dict[Tuple[int, ...], float] = {}
+        sources: Dict[Tuple[int, ...], set] = {}
+        spelling: Dict[Tuple[int, ...], str] = {}
+
+        for page, candidates in enumerate(candidates_per_page):
+            for candidate in candidates:
+                name_spans = self._name_spans(name_tokens, candidate)
+                if not name_spans:
+                    continue
+                if _PRERELEASE_WORDS.search(candidate):
+                    continue
+                bonus = 1.0 if _LATEST_WORDS.search(candidate) else 0.0
+                for match in _VERSION.finditer(candidate):
+                    if match.group(2):
+                        continue  # Pre-release suffix
+                    version = match.group(1)
+                    key = _version_key(version)
+                    closeness = self._closeness(name_spans, *match.span())
+                    scores[key] = scores.get(key, 0.0) + 1.0 + closeness + bonus
+                    sources.setdefault(key, set()).add(page)
+                    if len(version) > len(spelling.get(key, "")):
+                        spelling[key] = version
+
+        if not scores:
+            return Resolution(None, 0.0), 0
+
+        winner = max(scores, key=lambda key: (scores[key], len(sources[key]), key))
+        share = scores[winner] / sum(scores.values())
+        # Pages without any evidence count against it too
+        coverage = len(sources[winner]) / len(candidates_per_page)
+        confidence = 0.5 * share + 0.5 * coverage
+        if winner != max(scores):
+            confidence *= 0.5
+
+        debug("Resolver scores for %s: %s", name,
+              {spelling[key]: round(scores[key], 2) for key in scores})
+        info("Resolver picked %s for %s with confidence %.2f from %d pages",
+             spelling[winner], name, confidence, len(sources[winner]))
+        return Resolution(spelling[winner], round(confidence, 3)), len(sources[winner])
+
+    def decide(self, name: str, candidates_per_page: List[List[str]]) -> Resolution:
+        """Resolution when confident enough and backed by enough independent
+        pages, otherwise Resolution(None, confidence)"""
+        resolution, pages = self._resolve(name, candidates_per_page)
+        if (resolution.version is not None and resolution.confidence >= self.threshold
+                and pages >= self.min_pages):
+            return resolution
+        return Resolution(None, resolution.confidence)